@@ -0,0 +1,62 @@
+"""Word cloud rendering off the request thread.
+
+Clouds are rendered to PNG bytes in a process pool and cached under a hash of
+their (collocate, weight) pairs and options, so a rerun with the same table
+reuses the image and layout never blocks the Streamlit script thread.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import wordcloud
+
+
+def make_cloud_png(pairs, background='white', width=500, height=500, font_path=None, prefer_horizontal=0.9):
+    """Render a word cloud for ``{word: weight}`` as PNG bytes. Runs in the worker processes."""
+    wc = wordcloud.WordCloud(
+        font_path=font_path,
+        background_color=background,
+        width=width,
+        ranks_only=True,
+        height=height,
+        prefer_horizontal=prefer_horizontal
+        ).generate_from_frequencies(pairs)
+    output = BytesIO()
+    wc.to_image().save(output, format="PNG")
+    return output.getvalue()
+
+
+def cloud_key(pairs, options):
+    """Content hash of the cloud's weights and rendering options."""
+    content = json.dumps([sorted(pairs.items()), sorted(options.items())], default=str)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class CloudCache:
+    """LRU cache of futures for rendered clouds, keyed by :func:`cloud_key`.
+
+    :param pool: a ``concurrent.futures.ProcessPoolExecutor``
+    :param max_entries: number of clouds to keep
+    """
+
+    def __init__(self, pool, max_entries=256):
+        self._pool = pool
+        self._max_entries = max_entries
+        self._futures = OrderedDict()
+        self._lock = threading.Lock()
+
+    def render(self, pairs, **options):
+        """Future for the PNG bytes of the cloud; an identical cloud is only rendered once."""
+        key = cloud_key(pairs, options)
+        with self._lock:
+            future = self._futures.get(key)
+            if future is not None and not (future.done() and future.exception() is not None):
+                self._futures.move_to_end(key)
+                return future
+            future = self._pool.submit(make_cloud_png, pairs, **options)
+            self._futures[key] = future
+            while len(self._futures) > self._max_entries:
+                self._futures.popitem(last=False)
+        return future
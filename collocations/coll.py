@@ -1,5 +1,4 @@
 import warnings
-import matplotlib.pyplot as plt
 import streamlit as st
 from st_aggrid import AgGrid, GridOptionsBuilder, ColumnsAutoSizeMode
 from st_aggrid.shared import GridUpdateMode
@@ -7,46 +6,53 @@ import dhlab.api.dhlab_api as d2
 import dhlab.text.conc_coll as cc
 import pandas as pd
 import datetime
-import base64
-from io import BytesIO
 from random import sample
 from collections import Counter
-import wordcloud
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
 import json
+import refstore
+import collstats
+import prefetch
+import cloudcache
+import render
+import export
+import corpusdef
 
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
 limit_conc = 10
+max_window = 50
+collocation_workers = 8
+prefetch_distances = 2 # one-sided windows this many steps from the sliders are fetched in the background
+prefetch_top = 5
+prefetch_workers = 4
+cloud_workers = 2
 
 doctypes = {'Alle dokumenter': 'all', 'Aviser': 'digavis', 'Bøker': 'digibok', 'Tidsskrift': 'digitidsskrift', 'Stortingsdokumenter': 'digistorting'}
 
 references = {
-    "generisk referanse (1800-2022)": "reference/nob-nno_1800_2022.csv",
-    "nåtidig bokmål (2000-)": "reference/nob_2000_2022.csv",
-    "nåtidig nynorsk (2000-)": "reference/nno_2000_2022.csv",
-    "bokmål (1950-2000)": "reference/nob_1950_2000.csv",
-    "nynorsk (1950-2000)": "reference/nno_1950_2000.csv",
-    "bokmål (1920-1950)": "reference/nob_1920_1950.csv",
-    "nynorsk (1920-1950)": "reference/nno_1920_1950.csv",
-    "bokmål (1875-1920)": "reference/nob_1875_1920.csv",
-    "nynorsk (1875-1920)": "reference/nno_1875_1920.csv",
-    "tidlig dansk-norsk/bokmål (før 1875)": "reference/nob_1800_1875.csv",
-    "tidlig nynorsk (før 1875)": "reference/nob_1848_1875.csv"
+    "generisk referanse (1800-2022)": "nob-nno_1800_2022",
+    "nåtidig bokmål (2000-)": "nob_2000_2022",
+    "nåtidig nynorsk (2000-)": "nno_2000_2022",
+    "bokmål (1950-2000)": "nob_1950_2000",
+    "nynorsk (1950-2000)": "nno_1950_2000",
+    "bokmål (1920-1950)": "nob_1920_1950",
+    "nynorsk (1920-1950)": "nno_1920_1950",
+    "bokmål (1875-1920)": "nob_1875_1920",
+    "nynorsk (1875-1920)": "nno_1875_1920",
+    "tidlig dansk-norsk/bokmål (før 1875)": "nob_1800_1875",
+    "tidlig nynorsk (før 1875)": "nno_1848_1875"
 }
 
-# ADAPTED FROM: https://discuss.streamlit.io/t/how-to-download-file-in-streamlit/1806
-@st.cache(suppress_st_warning=True, show_spinner=False)
-def get_table_download_link(content, link_content="XLSX", filename="corpus.xlsx"):
-    """Generates a link allowing the data in a given panda dataframe to be downloaded
-    in:  dataframe
-    out: href string
-    """
-    try:
-        b64 = base64.b64encode(content.encode()).decode()  # some strings <-> bytes conversions necessary here
-    except:
-        b64 = base64.b64encode(content).decode()
-    href = f'<a href="data:file/csv;base64,{b64}" download="{filename}">{link_content}</a>'
-    return href
+# references synthesized from the period references for the corpus' own year span
+span_references = {
+    "bokmål, tilpasset korpusets årsspenn": "nob",
+    "nynorsk, tilpasset korpusets årsspenn": "nno"
+}
+
+# languages with period references, for collocations over time
+period_langs = {"bokmål": "nob", "nynorsk": "nno"}
 
 # ADAPTED FROM: https://github.com/streamlit/example-app-interactive-table/blob/main/streamlit_app.py
 def aggrid_interactive_table(df: pd.DataFrame):
@@ -74,16 +80,6 @@ def aggrid_interactive_table(df: pd.DataFrame):
 
     return selection
 
-@st.cache(suppress_st_warning=True, show_spinner=False)
-def to_excel(df, index_arg=False):
-    output = BytesIO()
-
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df.to_excel(writer, sheet_name='Sheet1', index=index_arg)
-
-    processed_data = output.getvalue()
-    return processed_data
-
 def sampling(a, b):
     res = a
     if b < len(a):
@@ -91,34 +87,86 @@ def sampling(a, b):
     return res
 
 @st.cache(suppress_st_warning=True, show_spinner = False)
-def get_collocation(words, corpus, before = 5, after = 5, reference = None):
+def get_collocation_counts(words, corpus, before = 5, after = 5):
+    """Raw collocate counts, fetched once per word, corpus and window."""
     try:
-        colls = cc.Collocations(words=words, corpus=corpus, before=before, after=after, reference=reference)
-        colls = colls.show(sortby="relevance", n=1000)
+        colls = cc.Collocations(words=words, corpus=corpus, before=before, after=after).coll
     except:
         st.error("Kollokasjoner kunne ikke hentes. Se på parametrene for korpuset/kollokasjonene eller prøv igjen. Problemet kan oppstå hvis du bruker et veldig stort korpus som strekker seg over mange år.")
         st.stop()
     return colls
 
-def make_cloud(json_text, top=100, background='white', stretch=lambda x: 2**(10*x), width=500, height=500, font_path=None, prefer_horizontal=0.9):
-    pairs0 = Counter(json_text).most_common(top)
-    pairs = {x[0]:stretch(x[1]) for x in pairs0}
-    wc = wordcloud.WordCloud(
-        font_path=font_path,
-        background_color=background,
-        width=width,
-        #color_func=my_colorfunc,
-        ranks_only=True,
-        height=height,
-        prefer_horizontal=prefer_horizontal
-        ).generate_from_frequencies(pairs)
-    return wc
-
-@st.cache(suppress_st_warning=True, show_spinner=False)
-def get_wordcloud(data, top=10):
+def fetch_side_counts(words, urns, side, distance):
+    """Collocate counts for the one-sided window of ``distance`` words ``side`` ("before" or "after") the base word."""
+    if distance == 0:
+        return pd.Series(dtype="int64", name="counts")
+    before, after = (distance, 0) if side == "before" else (0, distance)
+    return cc.Collocations(words=words, corpus=list(urns), before=before, after=after).coll["counts"]
+
+@st.experimental_singleton(show_spinner=False)
+def get_side_cache():
+    """One-sided window counts, fetched on a bounded thread pool and shared by all sessions."""
+    return prefetch.Prefetcher(ThreadPoolExecutor(max_workers=collocation_workers), fetch_side_counts, max_entries=256)
+
+def get_window_counts(words, corpus, before = 5, after = 5):
+    """Collocate counts for a window, summed locally from its two one-sided windows.
+
+    The collocation API only returns counts summed over a window, never per
+    distance, so a window cannot be cut locally out of one large fetch. The
+    two sides are fetched concurrently and cached for all sessions, and the
+    sides a slider step or two away are fetched in the background, so moving a
+    slider usually finds its side already fetched.
+    """
+    urns = tuple(corpus["urn"])
+    current = [(words, urns, "before", before), (words, urns, "after", after)]
+    nearby = [
+        (words, urns, side, distance + step)
+        for side, distance in [("before", before), ("after", after)]
+        for step in range(-prefetch_distances, prefetch_distances + 1)
+        if step != 0 and 0 < distance + step <= max_window
+    ]
+    try:
+        cache = get_side_cache()
+        cache.schedule(current)
+        cache.schedule(nearby)
+        counts = collstats.combine_sides(*(cache.get(key) for key in current))
+    except:
+        st.error("Kollokasjoner kunne ikke hentes. Se på parametrene for korpuset/kollokasjonene eller prøv igjen. Problemet kan oppstå hvis du bruker et veldig stort korpus som strekker seg over mange år.")
+        st.stop()
+    return counts
+
+def get_collocation(words, corpus, before = 5, after = 5, reference = None, positional = False):
+    """Score the cached collocate counts locally against a reference in the reference store.
+
+    With ``positional`` the window is put together from cached one-sided
+    windows, see :func:`get_window_counts`.
+    """
+    if positional:
+        counts = get_window_counts(words=words, corpus=corpus, before=before, after=after)
+    else:
+        counts = get_collocation_counts(words=words, corpus=corpus, before=before, after=after)
+    try:
+        colls = collstats.score_collocations(counts, get_reference_store(), reference, n=1000)
+    except:
+        st.error("Statisk referansekorpus kunne ikke hentes. Se på parametrene for korpuset eller prøv igjen.")
+        st.stop()
+    return colls
+
+@st.experimental_singleton(show_spinner=False)
+def get_cloud_cache():
+    """Word cloud cache with its own process pool, shared by all sessions.
+
+    Workers are spawned rather than forked from the multithreaded Streamlit server.
+    """
+    pool = ProcessPoolExecutor(max_workers=cloud_workers, mp_context=multiprocessing.get_context("spawn"))
+    return cloudcache.CloudCache(pool)
+
+def get_wordcloud(data, top=10, stretch=lambda x: 2**(10*x)):
+    """Future for the word cloud PNG of the ``top`` rows of ``data``, rendered off-thread."""
     scaled_data = data.sum(axis=1) / data.sum()[0]
-    wc = make_cloud(json.loads(scaled_data.to_json()), top=top, background='white', font_path=None, stretch=lambda x: 2**(10*x), width=1000, height=1000, prefer_horizontal=1.0)
-    return wc
+    pairs0 = Counter(json.loads(scaled_data.to_json())).most_common(top)
+    pairs = {x[0]:stretch(x[1]) for x in pairs0}
+    return get_cloud_cache().render(pairs, background='white', font_path=None, width=1000, height=1000, prefer_horizontal=1.0)
 
 @st.cache(suppress_st_warning=True, show_spinner = False)
 def get_reference(corpus, from_year = 1990, to_year = 2020, limit=50000):
@@ -149,49 +197,95 @@ def get_dynamic_reference(doctype="digibok", corpus=None, limit=1000):
         st.stop()
     return reference
 
-@st.cache(suppress_st_warning=True, show_spinner = False)
-def get_static_reference(path=None):
+@st.experimental_singleton(show_spinner=False)
+def get_reference_store():
+    """Memory-mapped reference store, shared by all sessions in the process."""
+    try:
+        return refstore.ReferenceStore()
+    except (FileNotFoundError, ValueError):
+        # missing, or written in an older format
+        return refstore.ReferenceStore(refstore.build_store())
+
+def get_span_reference(corpus=None, lang="nob"):
+    """Reference for the corpus' year span, combined locally from the period references."""
     try:
-        reference = pd.read_csv(path, header=None)
-        reference.columns = ["word", "freq"]
-        reference = reference.set_index("word")
+        years = pd.to_numeric(corpus["year"], errors="coerce").dropna()
+        reference = get_reference_store().span_reference(int(years.min()), int(years.max()), lang=lang)
     except:
-        st.error("Statisk referansekorpus kunne ikke hentes. Se på parametrene for korpuset eller prøv igjen.")
+        st.error("Referansekorpus for korpusets årsspenn kunne ikke lages. Se på parametrene for korpuset eller prøv igjen.")
         st.stop()
     return reference
 
-@st.cache(suppress_st_warning=True, show_spinner=False)
-def get_concordances(corpus, query, limit=5000, window=20):
+def fetch_bucket_counts(words, urns, before=5, after=5):
+    return cc.Collocations(words=words, corpus=list(urns), before=before, after=after).coll
+
+@st.experimental_singleton(show_spinner=False)
+def get_bucket_cache():
+    """Collocate counts per period bucket, fetched on a bounded thread pool and shared by all sessions."""
+    return prefetch.Prefetcher(ThreadPoolExecutor(max_workers=collocation_workers), fetch_bucket_counts)
+
+def get_collocation_trends(words, corpus, before = 5, after = 5, lang = "nob", n = 20, counts_min = 0, relevance_min = 0):
+    """Relevance of collocates per period, each period scored against its own period reference.
+
+    The corpus is split into the periods of the reference store and the
+    buckets are fetched concurrently.
+    """
     try:
-        conc = cc.Concordance(corpus, query, limit=5000, window=window)
+        store = get_reference_store()
+        periods = store.periods(lang)
+        buckets = collstats.assign_periods(corpus["year"], periods)
+        keys = {
+            period: (words, tuple(corpus["urn"][buckets == period]), before, after)
+            for period in sorted(periods) if (buckets == period).any()
+        }
+        cache = get_bucket_cache()
+        cache.schedule(keys.values())
+        scored = {
+            "%s–%s" % periods[period]: collstats.score_collocations(cache.get(key), store, period)
+            for period, key in keys.items()
+        }
     except:
-        st.error("Konkordanser kunne ikke hentes.")
+        st.error("Kollokasjoner over tid kunne ikke hentes. Se på parametrene for korpuset/kollokasjonene eller prøv igjen.")
         st.stop()
-    return conc
+    return collstats.trend_matrix(scored, n=n, counts_min=counts_min, relevance_min=relevance_min)
 
-def print_concordances(conc):
-    for row in conc.show(n=min(limit_conc, conc.size), style = False).iterrows():
-        urn = row[1]["urn"]
-        metadata = corpus[corpus["urn"] == urn][['title', 'authors', 'year', 'timestamp']]
-        metadata = metadata.iloc[0]
+def near_query(words, collword, before=5, after=5):
+    return """NEAR("%s" "%s", %s)""" % (words, collword, str(int(before) + int(after)))
+
+def fetch_concordances(urns, query, window=20):
+    return cc.Concordance(list(urns), query, limit=5000, window=window)
+
+@st.experimental_singleton(show_spinner=False)
+def get_prefetch_pool():
+    """Bounded thread pool for concordance prefetching, shared by all sessions."""
+    return ThreadPoolExecutor(max_workers=prefetch_workers)
+
+def get_prefetcher():
+    """Per-session concordance prefetcher; its results also serve as the concordance cache."""
+    if "conc_prefetcher" not in st.session_state:
+        st.session_state.conc_prefetcher = prefetch.Prefetcher(get_prefetch_pool(), fetch_concordances)
+    return st.session_state.conc_prefetcher
 
-        if 'digavis' in urn:
-            timestamp = metadata["timestamp"]
-        else:
-            timestamp = metadata["year"]
+def prefetch_concordances(corpus, queries, window=20):
+    """Start fetching concordances for ``queries`` in the background, dropping queued stale ones."""
+    urns = tuple(corpus["urn"])
+    get_prefetcher().prefetch([(urns, query, window) for query in queries])
 
-        if metadata["authors"] is None:
-            metadata["authors"] = ""
-        if metadata["title"] is None:
-            metadata["title"] = ""
+def get_concordances(corpus, query, limit=5000, window=20):
+    try:
+        conc = get_prefetcher().get((tuple(corpus["urn"]), query, window))
+    except:
+        st.error("Konkordanser kunne ikke hentes.")
+        st.stop()
+    return conc
 
-        url = "https://urn.nb.no/%s" % (urn)
-        link = "<a href='%s' target='_blank'>%s – %s – %s</a>" % (url, metadata["title"], metadata["authors"], timestamp)
+@st.cache(suppress_st_warning=True, show_spinner = False)
+def get_urn_index(corpus):
+    return render.urn_index(corpus)
 
-        conc_markdown = row[1]["concordance"].replace('<b>', '**')
-        conc_markdown = conc_markdown.replace('</b>', '**')
-        html = "%s %s" % (link, conc_markdown)
-        st.markdown(html, unsafe_allow_html=True)
+def print_concordances(conc):
+    rows = conc.show(n=min(limit_conc, conc.size), style = False)
+    st.markdown(render.concordance_markdown(rows, get_urn_index(corpus)), unsafe_allow_html=True)
 
 # Streamlit stuff
 st.set_page_config(page_title="NB DH-LAB – Kollokasjoner", layout='wide')
@@ -204,7 +298,7 @@ st.write("Appen gir deg kollokasjoner fra [DH-LAB](https://www.nb.no/dh-lab) ved
 words = st.text_input("Søk", "", placeholder="Skriv inn basisord her")
 
 uploaded_corpus = st.sidebar.file_uploader(
-    "Last opp korpusdefinisjon som Excel-ark", type=["xlsx"], accept_multiple_files=False, key="corpus_upload"
+    "Last opp korpusdefinisjon (Excel, Parquet eller CSV)", type=["xlsx", "parquet", "csv"], accept_multiple_files=False, key="corpus_upload"
 )
 
 if st.session_state.corpus_upload is None:
@@ -231,18 +325,22 @@ if st.session_state.corpus_upload is None:
 
 title = st.sidebar.title("Parametre")
 
-reference_corpus = st.sidebar.selectbox("Velg referansekorpus", references.keys(), index=0, help="Velg referansekorpus som kollokasjonene skal beregnes på bakgrunn av.")
+reference_corpus = st.sidebar.selectbox("Velg referansekorpus", list(references) + list(span_references), index=0, help="Velg referansekorpus som kollokasjonene skal beregnes på bakgrunn av. Valgene tilpasset korpusets årsspenn settes sammen av periodereferansene, vektet etter hvor mye hver periode overlapper med årene i korpuset.")
 
 before = st.sidebar.slider(
-    'Ord før basisord', min_value=0, max_value=50, value=5
+    'Ord før basisord', min_value=0, max_value=max_window, value=5
 )
 after = st.sidebar.slider(
-    'Ord etter basisord', min_value=0, max_value=50, value=5
+    'Ord etter basisord', min_value=0, max_value=max_window, value=5
 )
+positional = st.sidebar.checkbox('Husk vindusstørrelser', value=False, help="Henter ord før og ord etter basisordet hver for seg og husker dem. En ny verdi på en av glidebryterne henter bare den siden som er endret, og verdiene rett ved siden av hentes i bakgrunnen.")
 relevance_min = st.sidebar.number_input('Terskelverdi: Relevans', value=10)
 counts_min = st.sidebar.number_input('Terskelverdi: Råfrekvens', value=5)
 head = st.sidebar.number_input('Maks. antall kollokasjoner som vises ', value=20)
 sort_by = st.sidebar.selectbox("Sorter etter", ["Relevans", "Råfrekvens"], index=0, help="Velg om kollokasjoner skal sorteres etter relevans eller råfrekvens (etter kutting).")
+trends = st.sidebar.checkbox('Vis kollokasjoner over tid', value=False, help="Deler korpuset inn i periodene til referansekorpusene, henter kollokasjoner for hver periode samtidig og beregner relevans mot referansen for samme periode.")
+if trends:
+    trend_lang = st.sidebar.selectbox("Periodereferanser", period_langs.keys(), index=0)
 reference = ""
 
 if words == "":
@@ -254,14 +352,21 @@ if st.session_state.corpus_upload is None:
     with st.spinner('Sampler nytt korpus...'):
         corpus = get_corpus(doctype=doctype, from_year=from_year, to_year=to_year, limit=limit, freetext=freetext, fulltext=fulltext)
 else:
-    corpus = pd.read_excel(uploaded_corpus)
+    try:
+        corpus = corpusdef.load_upload(uploaded_corpus)
+    except:
+        st.error("Korpusfilen kunne ikke leses, eller innholdet stemmer ikke med sjekksummen i filen. Last ned korpuset på nytt fra korpusappen.")
+        st.stop()
 
 # get reference corpus
-reference = get_static_reference(references[reference_corpus])
+if reference_corpus in span_references:
+    reference = get_span_reference(corpus=corpus, lang=span_references[reference_corpus])
+else:
+    reference = references[reference_corpus]
 
 # get colls
 with st.spinner('Henter kollokasjoner...'):
-    colls = get_collocation(words=words, corpus=corpus, before=before, after=after, reference=reference)
+    colls = get_collocation(words=words, corpus=corpus, before=before, after=after, reference=reference, positional=positional)
 colls = colls[(colls.relevance > relevance_min) & (colls.counts > counts_min)].head(head)
 
 colls = colls.reset_index()
@@ -273,40 +378,40 @@ if sort_by == "Råfrekvens":
 # round
 colls["Relevans"] = colls["Relevans"].round(2)
     
-excel_colls = to_excel(colls)
-excel_corpus = to_excel(corpus)
-
 col1, col2 = st.columns(2)
 
 if st.session_state.corpus_upload is None:
     with col1:
-        st.markdown("__Korpusstørrelse:__ " + str(len(corpus)) + " dokumenter. " + "Last ned " + get_table_download_link(excel_corpus, link_content="korpusdefinisjon.", filename="corpus.xlsx"), unsafe_allow_html=True)
+        st.markdown("__Korpusstørrelse:__ " + str(len(corpus)) + " dokumenter.", unsafe_allow_html=True)
+        export.export_widget(corpus, "Last ned korpusdefinisjon", "corpus", key="export_corpus")
 else:
     with col1:
         st.markdown("__Korpusstørrelse:__ " + str(len(corpus)) + " dokumenter (__opplastet korpusdefinsjon__). ",  unsafe_allow_html=True)
 
 with col2:
-    st.markdown("Last ned " + get_table_download_link(excel_colls, link_content="kollokasjonstbaell", filename="collocations.xlsx") + ".", unsafe_allow_html=True)
+    export.export_widget(colls, "Last ned kollokasjonstabell", "collocations", key="export_colls")
 
 
 with col1:
     selection = aggrid_interactive_table(df=colls)
     #st.write(colls.to_html(escape=False, index=False), unsafe_allow_html=True)
+
+# fetch examples for the top collocates while the user looks at the table
+prefetch_concordances(corpus, [near_query(words, collword, before, after) for collword in colls["Kollokat"].head(prefetch_top)], window=20)
+
 with col2:
+    # the cloud renders in the background and fills the placeholder at the end of the page
+    cloud_placeholder = st.empty()
     try:
-        wc = get_wordcloud(colls[["Kollokat", sort_by]].set_index("Kollokat"), top=head)
-        fig, ax = plt.subplots(figsize = (5, 5))
-        ax.imshow(wc)
-        plt.axis("off")
-        st.pyplot(fig)
+        cloud = get_wordcloud(colls[["Kollokat", sort_by]].set_index("Kollokat"), top=head)
     except:
-        pass
+        cloud = None
 
 try:
     if selection["selected_rows"] != []:
         selected_collword = selection["selected_rows"][0]["Kollokat"]
 
-        query = """NEAR("%s" "%s", %s)""" % (words, selected_collword, str(int(before) + int(after)))
+        query = near_query(words, selected_collword, before, after)
 
         with st.spinner('Henter konkordanser...'):
             conc = get_concordances(corpus, query, limit=5000, window=20)
@@ -317,5 +422,21 @@ try:
 except:
     pass
 
+if cloud is not None:
+    try:
+        with cloud_placeholder:
+            with st.spinner('Lager ordsky...'):
+                png = cloud.result()
+        cloud_placeholder.image(png, use_column_width=True)
+    except:
+        cloud_placeholder.empty()
+
+if trends:
+    with st.spinner('Henter kollokasjoner per periode...'):
+        trend = get_collocation_trends(words=words, corpus=corpus, before=before, after=after, lang=period_langs[trend_lang], n=head, counts_min=counts_min, relevance_min=relevance_min)
+    st.markdown("### Kollokasjoner over tid")
+    st.markdown("Relevans per periode, beregnet mot referansekorpuset for samme periode. Tomme celler betyr at kollokatet ikke når terskelverdiene i perioden.")
+    st.dataframe(trend.round(2))
+
 st.write('\n')
 st.write('\n__Bakgrunn__: Det statistiske kollokasjonsmålet som brukes her, er en variant av PMI (pointwise mutual information), med sannsynligheter som proporsjoner av frekvens, på formen: 𝑝𝑚𝑖(𝑥,𝑦)=𝑝(𝑥|𝑦)𝑝(𝑥)=𝑝(𝑦|𝑥)𝑝(𝑦). Det kan ses på som en probabilistisk versjon av relevans, dvs. at y er relevant x og omvendt. PMI er brukt i stedet for tf-idf for å beregne assosisasjoner mellom ord. PMI-verdiene er beregnet på normaliserte frekvenser (relativfrekvenser) som betyr at det faktiske tallet kan tolkes som et disproporsjonalt tall.')
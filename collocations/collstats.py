@@ -0,0 +1,95 @@
+"""Local collocation statistics on top of raw collocate counts.
+
+The remote collocation service is only asked for raw counts; relevance against
+a reference is computed here, so changing the reference does not refetch.
+"""
+import numpy as np
+import pandas as pd
+
+
+def reference_counts(store, index, reference):
+    """Look up reference frequencies for the words in ``index``.
+
+    :param store: a :class:`refstore.ReferenceStore`
+    :param index: collocate words
+    :param reference: name of a reference column in ``store``, or a tuple of
+        (counts aligned with the store's count columns, total) as returned by
+        :meth:`refstore.ReferenceStore.span_reference`
+    :return: tuple of (float counts aligned with ``index``, reference total)
+    """
+    if isinstance(reference, str):
+        column = store.column(reference)
+        total = store.totals[reference]
+    else:
+        column, total = reference
+    positions = store.lookup(index)
+    found = positions >= 0
+    counts = np.zeros(len(positions), dtype=np.float64)
+    counts[found] = column[positions[found]]
+    return counts, total
+
+
+def score_collocations(coll, store, reference, n=1000):
+    """Compute relevance of raw collocate counts against a reference.
+
+    Relevance is the ratio of relative frequencies, the same measure as
+    ``cc.Collocations`` computes when given a reference. Collocates missing
+    from the reference get NaN.
+
+    :param coll: frame indexed by collocate with a ``counts`` column
+    :param store: a :class:`refstore.ReferenceStore`
+    :param reference: reference name or span reference, see :func:`reference_counts`
+    :param n: number of collocates to return, sorted by relevance
+    """
+    counts = coll["counts"].to_numpy(dtype=np.float64)
+    ref, total = reference_counts(store, coll.index, reference)
+    relevance = np.full(len(counts), np.nan)
+    np.divide(counts / counts.sum() * total, ref, out=relevance, where=ref > 0)
+    scored = pd.DataFrame({"counts": coll["counts"].to_numpy(), "relevance": relevance}, index=coll.index)
+    return scored.sort_values(by="relevance", ascending=False).head(n)
+
+
+def combine_sides(before, after):
+    """Collocate counts for a two-sided window from its one-sided parts.
+
+    The window of ``b`` words before and ``a`` words after the base word is
+    the sum of the window of ``b`` words before only and ``a`` words after
+    only.
+    """
+    counts = before.add(after, fill_value=0).astype("int64")
+    coll = pd.DataFrame({"counts": counts})
+    return coll[coll.counts > 0]
+
+
+def assign_periods(years, periods):
+    """Name of the period each of ``years`` falls in.
+
+    Each year goes to the latest period starting at or before it; years before
+    the first period go to the first one and missing years to ``None``.
+
+    :param periods: ``{name: (from_year, to_year)}``, see
+        :meth:`refstore.ReferenceStore.periods`
+    """
+    names = sorted(periods, key=lambda name: periods[name][0])
+    starts = np.array([periods[name][0] for name in names])
+    years = pd.to_numeric(pd.Series(years), errors="coerce").to_numpy(dtype=np.float64)
+    positions = np.clip(np.searchsorted(starts, years, side="right") - 1, 0, len(names) - 1)
+    assigned = np.array(names, dtype=object)[positions]
+    assigned[np.isnan(years)] = None
+    return assigned
+
+
+def trend_matrix(scored, n=20, counts_min=0, relevance_min=0):
+    """Collocate × period relevance matrix from ``{period: scored collocations}``.
+
+    Rows are the union of the ``n`` most relevant collocates of each period
+    after thresholding, ordered by their highest relevance in any period.
+    """
+    columns = {
+        period: coll.relevance[(coll.relevance > relevance_min) & (coll.counts > counts_min)]
+        for period, coll in scored.items()
+    }
+    matrix = pd.DataFrame(columns)
+    top = pd.Index([]).append([column.nlargest(n).index for column in columns.values()]).unique()
+    matrix = matrix.loc[top]
+    return matrix.loc[matrix.max(axis=1).sort_values(ascending=False).index]
@@ -0,0 +1,83 @@
+"""Reading corpus definition files made by the corpus app.
+
+The native format is Parquet and carries a content hash of the corpus table,
+which is checked on load; a file whose content does not match its hash is
+rejected. Excel and CSV files are still read, so older corpus definitions
+keep working.
+
+Uploads are parsed once per process and cached by the hash of the file bytes,
+so Streamlit reruns do not parse the same file again.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+HASH_KEY = b"dhlab_corpus_hash"
+PARQUET_MAGIC = b"PAR1"
+ZIP_MAGIC = b"PK\x03\x04"
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+cache_size = 16
+
+
+def file_hash(data):
+    """SHA-256 of the raw bytes of an uploaded file."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def corpus_hash(corpus):
+    """SHA-256 of the corpus table's content, independent of file format."""
+    digest = hashlib.sha256(json.dumps([str(c) for c in corpus.columns]).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(corpus, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def read_parquet(data):
+    """Parse a Parquet corpus definition, checking the content hash when the file has one."""
+    table = pq.read_table(BytesIO(data))
+    corpus = table.to_pandas()
+    expected = (table.schema.metadata or {}).get(HASH_KEY)
+    if expected is not None and corpus_hash(corpus) != expected.decode("ascii"):
+        raise ValueError("Corpus content does not match the hash stored in the file")
+    return corpus
+
+
+def read_corpus(data, filename=""):
+    """Parse a corpus definition from Parquet, Excel or CSV bytes."""
+    if data.startswith(PARQUET_MAGIC) or filename.endswith(".parquet"):
+        return read_parquet(data)
+    if data.startswith(ZIP_MAGIC) or filename.endswith(".xlsx"):
+        return pd.read_excel(BytesIO(data))
+    return pd.read_csv(BytesIO(data))
+
+
+def load_corpus(data, filename=""):
+    """Parse a corpus definition once per process, cached by the hash of the file bytes.
+
+    :param data: bytes of the uploaded file
+    :param filename: used as a format hint when the bytes are ambiguous
+    :return: a copy of the cached corpus frame
+    """
+    key = file_hash(data)
+    with _cache_lock:
+        corpus = _cache.get(key)
+        if corpus is not None:
+            _cache.move_to_end(key)
+    if corpus is None:
+        corpus = read_corpus(data, filename)
+        with _cache_lock:
+            _cache[key] = corpus
+            while len(_cache) > cache_size:
+                _cache.popitem(last=False)
+    return corpus.copy()
+
+
+def load_upload(uploaded_file):
+    """:func:`load_corpus` for a Streamlit ``UploadedFile``."""
+    return load_corpus(uploaded_file.getvalue(), uploaded_file.name)
@@ -0,0 +1,72 @@
+"""Speculative background fetching for the collocations app.
+
+A :class:`Prefetcher` schedules fetches on a bounded thread pool shared by the
+whole process. A per-session prefetcher uses :meth:`Prefetcher.prefetch`,
+which cancels queued fetches that are no longer wanted, so the pool only works
+on what the current page can use. A shared one uses
+:meth:`Prefetcher.schedule` and acts as a cache of results for all sessions.
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class Prefetcher:
+    """Keyed cache of futures for ``fetch(*key)`` calls.
+
+    :param pool: a ``concurrent.futures.Executor`` to run fetches on
+    :param fetch: function called with the items of a key
+    :param max_entries: number of results to keep; the oldest are dropped first
+    """
+
+    def __init__(self, pool, fetch, max_entries=64):
+        self._pool = pool
+        self._fetch = fetch
+        self._max_entries = max_entries
+        self._futures = OrderedDict()
+        self._lock = threading.Lock()
+
+    def prefetch(self, keys):
+        """Schedule ``keys`` and cancel queued fetches for any other key."""
+        keys = list(keys)
+        wanted = set(keys)
+        with self._lock:
+            for key, future in list(self._futures.items()):
+                if key not in wanted and future.cancel():
+                    del self._futures[key]
+        self.schedule(keys)
+
+    def schedule(self, keys):
+        """Schedule ``keys`` that are not already cached or queued."""
+        with self._lock:
+            for key in keys:
+                if key not in self._futures:
+                    self._futures[key] = self._pool.submit(self._fetch, *key)
+            self._evict()
+
+    def get(self, key):
+        """Result for ``key``, waiting for a scheduled fetch or fetching it now.
+
+        A prefetch that failed or was cancelled is retried in the calling
+        thread, so errors surface where the caller can handle them.
+        """
+        with self._lock:
+            future = self._futures.get(key)
+            if future is not None:
+                self._futures.move_to_end(key)
+        if future is not None and not future.cancelled() and future.exception() is None:
+            return future.result()
+
+        result = self._fetch(*key)
+        future = Future()
+        future.set_result(result)
+        with self._lock:
+            self._futures[key] = future
+            self._evict()
+        return result
+
+    def _evict(self):
+        while len(self._futures) > self._max_entries:
+            key = next(iter(self._futures))
+            self._futures.pop(key).cancel()
+
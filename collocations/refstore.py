@@ -0,0 +1,189 @@
+"""Binary store for the reference frequency lists in ``reference/``.
+
+All reference CSVs are merged into one shared vocabulary and a matrix with one
+uint32 count column per reference. The vocabulary is stored as a sorted
+fixed-width byte array, searched with ``np.searchsorted``, plus the
+permutations between sorted and count order. The app memory-maps the whole
+file, lookup structure included, so every Streamlit process and session reads
+the same pages and nothing is decoded into per-process memory.
+
+Build the store (done in the Dockerfile) with::
+
+    python refstore.py
+"""
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+REFERENCE_DIR = Path(__file__).parent / "reference"
+STORE_PATH = REFERENCE_DIR / "references.bin"
+
+MAGIC = b"DHREF002"
+HEADER_SIZE = 4096
+ALIGN = 64
+
+
+def _aligned(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def read_reference_csv(path):
+    """Read a reference CSV (word,freq without header) as a frequency series."""
+    reference = pd.read_csv(
+        path, header=None, names=["word", "freq"], dtype={"word": str}, keep_default_na=False
+    )
+    return reference.groupby("word")["freq"].sum()
+
+
+def build_store(reference_dir=REFERENCE_DIR, path=STORE_PATH):
+    """Merge all reference CSVs in ``reference_dir`` into a binary store at ``path``.
+
+    The vocabulary is ordered by summed frequency, so the most used words share
+    the first pages of every count column.
+    """
+    frames = {csv.stem: read_reference_csv(csv) for csv in sorted(Path(reference_dir).glob("*.csv"))}
+    if not frames:
+        raise FileNotFoundError(f"No reference CSVs found in {reference_dir}")
+
+    summed = pd.concat(frames.values(), axis=1).fillna(0).sum(axis=1)
+    vocabulary = summed.sort_values(ascending=False, kind="stable").index
+
+    counts = np.zeros((len(frames), len(vocabulary)), dtype=np.uint32)
+    for i, freq in enumerate(frames.values()):
+        counts[i, vocabulary.get_indexer(freq.index)] = freq.to_numpy()
+
+    encoded = [word.encode("utf-8") for word in vocabulary]
+    width = max(1, max(map(len, encoded)))
+    keys = np.array(encoded, dtype=f"S{width}")
+    order = np.argsort(keys, kind="stable").astype(np.uint32)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order), dtype=np.uint32)
+    keys = keys[order]
+
+    sections = {}
+    offset = HEADER_SIZE
+    for name, array in [("counts", counts), ("keys", keys), ("order", order), ("rank", rank)]:
+        sections[name] = (offset, array)
+        offset = _aligned(offset + array.nbytes)
+    header = {
+        "columns": list(frames),
+        "totals": [int(total) for total in counts.sum(axis=1, dtype=np.uint64)],
+        "n_words": len(vocabulary),
+        "width": width,
+        "offsets": {name: offset for name, (offset, _) in sections.items()},
+    }
+    header = MAGIC + json.dumps(header).encode("utf-8")
+    if len(header) > HEADER_SIZE:
+        raise ValueError("Too many references to fit in the store header")
+
+    tmp_path = Path(f"{path}.tmp{os.getpid()}")
+    with open(tmp_path, "wb") as f:
+        f.write(header.ljust(HEADER_SIZE, b"\0"))
+        for offset, array in sections.values():
+            f.write(b"\0" * (offset - f.tell()))
+            f.write(array.tobytes())
+    os.replace(tmp_path, path)
+    return path
+
+
+class ReferenceStore:
+    """Read-only, memory-mapped view of a store written by :func:`build_store`."""
+
+    def __init__(self, path=STORE_PATH):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            header = f.read(HEADER_SIZE)
+        if not header.startswith(MAGIC):
+            raise ValueError(f"{self.path} is not a reference store")
+        header = json.loads(header[len(MAGIC):].rstrip(b"\0"))
+
+        self.columns = header["columns"]
+        self.totals = dict(zip(self.columns, header["totals"]))
+        self.width = header["width"]
+        n_words, offsets = header["n_words"], header["offsets"]
+        self.counts = np.memmap(
+            self.path, dtype=np.uint32, mode="r",
+            offset=offsets["counts"], shape=(len(self.columns), n_words)
+        )
+        # vocabulary sorted bytewise, and the permutations between sorted and count order
+        self._keys = np.memmap(self.path, dtype=f"S{self.width}", mode="r", offset=offsets["keys"], shape=(n_words,))
+        self._order = np.memmap(self.path, dtype=np.uint32, mode="r", offset=offsets["order"], shape=(n_words,))
+        self._rank = np.memmap(self.path, dtype=np.uint32, mode="r", offset=offsets["rank"], shape=(n_words,))
+
+    def __len__(self):
+        """Number of words in the shared vocabulary."""
+        return len(self._keys)
+
+    def lookup(self, words):
+        """Positions of ``words`` in the count columns, -1 for words not in the vocabulary."""
+        encoded = [str(word).encode("utf-8") for word in words]
+        # longer words would be truncated to a prefix by the fixed width
+        fits = np.array([len(word) <= self.width for word in encoded], dtype=bool)
+        query = np.array(encoded, dtype=f"S{self.width}")
+        found = np.minimum(np.searchsorted(self._keys, query), len(self._keys) - 1)
+        match = fits & (self._keys[found] == query)
+        return np.where(match, self._order[found].astype(np.int64), -1)
+
+    def words(self, positions):
+        """Words at ``positions`` in the count columns."""
+        return [word.decode("utf-8") for word in self._keys[self._rank[positions]]]
+
+    def column(self, name):
+        """Counts for reference ``name`` (a CSV stem) aligned with the vocabulary."""
+        return self.counts[self.columns.index(name)]
+
+    def periods(self, lang="nob"):
+        """Period references for ``lang`` as ``{name: (from_year, to_year)}``, parsed from the column names."""
+        periods = {}
+        for name in self.columns:
+            parts = name.split("_")
+            if len(parts) == 3 and parts[0] == lang:
+                periods[name] = (int(parts[1]), int(parts[2]))
+        return periods
+
+    def span_reference(self, from_year, to_year, lang="nob"):
+        """Synthesize a reference for the years ``from_year``-``to_year`` from the period references.
+
+        Each period counts as the half-open year range ``[from, to)`` and
+        contributes its counts scaled by the share of the period that overlaps
+        the span, as if its tokens were spread evenly over its years. A span
+        outside all periods falls back to the nearest period.
+
+        :return: tuple of (float counts aligned with the vocabulary, token total)
+        """
+        periods = self.periods(lang)
+        if not periods:
+            raise KeyError(f"No period references for language {lang}")
+        start, end = from_year, to_year + 1
+        weights = {
+            name: max(0, min(end, period_end) - max(start, period_start)) / (period_end - period_start)
+            for name, (period_start, period_end) in periods.items()
+        }
+        if not any(weights.values()):
+            nearest = min(periods, key=lambda name: min(abs(start - periods[name][1]), abs(periods[name][0] - end)))
+            weights = {nearest: 1.0}
+
+        counts = np.zeros(self.counts.shape[1], dtype=np.float64)
+        total = 0.0
+        for name, weight in weights.items():
+            if weight > 0:
+                counts += weight * self.column(name)
+                total += weight * self.totals[name]
+        return counts, total
+
+    def reference(self, name):
+        """Reference ``name`` as the word-indexed ``freq`` frame used by ``cc.Collocations``."""
+        counts = self.column(name)
+        present = counts > 0
+        positions = np.flatnonzero(present)
+        return pd.DataFrame(
+            {"freq": counts[positions].astype(np.int64)}, index=pd.Index(self.words(positions), name="word")
+        )
+
+
+if __name__ == "__main__":
+    store = ReferenceStore(build_store())
+    print(f"Wrote {store.path}: {len(store)} words, {len(store.columns)} references")
@@ -1,35 +1,19 @@
 import streamlit as st
 import dhlab.api.dhlab_api as d2
-import dhlab.text.conc_coll as cc
-import pandas as pd
 import datetime
-import base64
-from io import BytesIO
 from random import sample
+import render
+import paging
+import kwic
+import dedup
+import export
+import corpusdef
 
-doctypes = {'Alle dokumenter': 'all', 'Aviser': 'digavis', 'Bøker': 'digibok', 'Tidsskrift': 'digitidsskrift', 'Stortingsdokumenter': 'digistorting'}
-
-# ADAPTED FROM: https://discuss.streamlit.io/t/how-to-download-file-in-streamlit/1806
-def get_table_download_link(content, link_content="XLSX", filename="corpus.xlsx"):
-    """Generates a link allowing the data in a given panda dataframe to be downloaded
-    in:  dataframe
-    out: href string
-    """
-    try:
-        b64 = base64.b64encode(content.encode()).decode()  # some strings <-> bytes conversions necessary here
-    except:
-        b64 = base64.b64encode(content).decode()
-    href = f'<a href="data:file/csv;base64,{b64}" download="{filename}">{link_content}</a>'
-    return href
+shard_size = 200
+shard_workers = 8
+max_shown_hits = 1000 # hits drawn per page of the view; all hits are in the download
 
-def to_excel(df, index_arg=False):
-    output = BytesIO()
-    
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df.to_excel(writer, sheet_name='Sheet1', index=index_arg)
-
-    processed_data = output.getvalue()
-    return processed_data
+doctypes = {'Alle dokumenter': 'all', 'Aviser': 'digavis', 'Bøker': 'digibok', 'Tidsskrift': 'digitidsskrift', 'Stortingsdokumenter': 'digistorting'}
 
 @st.cache(suppress_st_warning=True, show_spinner = False)
 def get_corpus(doctype="digibok", from_year=1990, to_year=2020, limit=1000, freetext=None, fulltext=None):
@@ -40,38 +24,40 @@ def get_corpus(doctype="digibok", from_year=1990, to_year=2020, limit=1000, free
         st.stop()
     return corpus
 
+def get_pager(corpus, query, window=20):
+    """Concordance pager for this session, restarted when the corpus, query or window changes."""
+    key = (tuple(corpus["urn"]), query, window)
+    if st.session_state.get("conc_pager_key") != key:
+        st.session_state.conc_pager = paging.ConcordancePager(corpus["urn"], query, window=window)
+        st.session_state.conc_pager_key = key
+    return st.session_state.conc_pager
+
+def get_kwic(pager):
+    """Columnar KWIC view of the pager's hits, parsing only hits added since the last rerun."""
+    if st.session_state.get("conc_kwic_pager") is not pager:
+        st.session_state.conc_kwic = None
+        st.session_state.conc_kwic_pager = pager
+    st.session_state.conc_kwic = kwic.extend_kwic(st.session_state.conc_kwic, pager.hits, get_urn_index(corpus))
+    return st.session_state.conc_kwic
+
 @st.cache(suppress_st_warning=True, show_spinner = False)
-def get_concordances(corpus, query, limit=5000, window=20):
+def collapse_duplicates(hits):
+    """One hit per group of near-identical concordances, with the group size in ``copies``."""
+    return dedup.collapse(hits)
+
+def fetch_page(pager, page_size=10):
     try:
-        conc = cc.Concordance(corpus, query, limit=5000, window=window)
+        pager.next_page(page_size)
     except:
         st.error("Konkordanser kunne ikke hentes. Se på parametrene for konkordans eller prøv igjen.")
         st.stop()
-    return conc
-
-def print_concordances(conc):
-    for row in conc.show(n=min(limit_conc, conc.size), style = False).iterrows():
-        urn = row[1]["urn"]
-        metadata = corpus[corpus["urn"] == urn][['title', 'authors', 'year', 'timestamp']]
-        metadata = metadata.iloc[0]
-
-        if 'digavis' in urn:
-            timestamp = metadata["timestamp"]
-        else:
-            timestamp = metadata["year"]
 
-        if metadata["authors"] is None:
-            metadata["authors"] = ""
-        if metadata["title"] is None:
-            metadata["title"] = ""
-
-        url = "https://urn.nb.no/%s" % (urn)
-        link = "<a href='%s' target='_blank'>%s – %s – %s</a>" % (url, metadata["title"], metadata["authors"], timestamp)
+@st.cache(suppress_st_warning=True, show_spinner = False)
+def get_urn_index(corpus):
+    return render.urn_index(corpus)
 
-        conc_markdown = row[1]["concordance"].replace('<b>', '**')
-        conc_markdown = conc_markdown.replace('</b>', '**')
-        html = "%s %s" % (link, conc_markdown)
-        st.markdown(html, unsafe_allow_html=True)
+def print_concordances(conc):
+    st.markdown(render.concordance_markdown(conc, get_urn_index(corpus)), unsafe_allow_html=True)
 
 st.set_page_config(page_title="NB DH-LAB – Konkordanser", layout='wide')
 
@@ -85,7 +71,7 @@ st.write("Appen gir deg konkordanser - nøkkelord med kontekst - fra [DH-LAB](ht
 query = st.text_input("Søk", "", placeholder="Skriv inn søkeuttrykk her")
 
 uploaded_corpus = st.sidebar.file_uploader(
-    "Last opp korpusdefinisjon som Excel-ark", type=["xlsx"], accept_multiple_files=False,  key="corpus_upload"
+    "Last opp korpusdefinisjon (Excel, Parquet eller CSV)", type=["xlsx", "parquet", "csv"], accept_multiple_files=False,  key="corpus_upload"
 )
 
 if st.session_state.corpus_upload is None:
@@ -116,48 +102,96 @@ if st.session_state.corpus_upload is None:
     with st.spinner('Sampler nytt korpus...'):
         corpus = get_corpus(doctype=doctype, from_year=from_year, to_year=to_year, limit=limit, freetext=freetext, fulltext=fulltext)
 else:
-    corpus = pd.read_excel(uploaded_corpus)
+    try:
+        corpus = corpusdef.load_upload(uploaded_corpus)
+    except:
+        st.error("Korpusfilen kunne ikke leses, eller innholdet stemmer ikke med sjekksummen i filen. Last ned korpuset på nytt fra korpusappen.")
+        st.stop()
 
 title = st.sidebar.title("Parametre for konkordans")
 
-limit_conc = st.sidebar.number_input('Antall konkordanser i sample', value=10)
+limit_conc = st.sidebar.number_input('Antall konkordanser per side', min_value=1, value=10)
 
 window = st.sidebar.number_input('Konkordansevindu (antall ord rundt søkeord)', min_value=1, max_value=25, value=20)
 
+collapse = st.sidebar.checkbox('Slå sammen nesten like treff', value=False, help="Viser ett treff for hver gruppe av nesten identiske konkordanser, f.eks. samme byråsak trykket i mange aviser, med antall like treff.")
+
 if query == "":
     st.info("For å søke, skriv inn et ord, flere ord eller en frase i anførselstegn. Søkemotoren gir treff på avsnittsnivå. Hvis det er flere treff innenfor et avsnitt, vil kun første treff fra det aktuelle avsnittet vises. Hvis det ikke oppgis en logisk operator (AND, OR, NOT), vil logisk AND brukes. Søket __vaksine forskning__ gir altså treff i avsnitt som inneholder både ordet __vaksine__ og __forskning__. Det er også mulig å angi et to ord skal stå i nærheten av hverandre, f.eks. vil NEAR(vaksine forskning, 5) gi kontekster der __vaksine__ og __forskning__ opptrer innenfor et vindu av fem ord. ")
     st.warning("Appen lager et tilfeldig uttrekk (sample) fra hele samlingen basert på parameterne i menyen til venstre. Det kan være lurt å stille på disse paramaterne for å få mer kontroll over korpuset. Hvis du søker på et sjeldent ord og/eller ønsker et større uttrekk, øk sample-verdien. For å være sikker på at ord du ønsker å søke på faktisk er inneholdt i uttrekket, bruk feltet 'som inneholder fulltekst'.")
     st.stop()
 
-with st.spinner('Henter konkordanser...'):
-    conc = get_concordances(corpus, query, limit=5000, window=window)
+pager = get_pager(corpus, query, window=window)
 
-excel_corpus = to_excel(corpus)
-excel_conc = to_excel(conc.concordance)
-
-show_number = min(conc.size, limit_conc)
+if pager.hits.empty and not pager.done:
+    with st.spinner('Henter konkordanser...'):
+        fetch_page(pager, limit_conc)
 
 col1, col2, col3 = st.columns(3)
 
+# handle the buttons before the hit count is written, so the count includes the new page
+fetch_all = False
+if not pager.done:
+    with col3:
+        if st.button('Hent flere konkordanser'):
+            with st.spinner('Henter flere konkordanser...'):
+                fetch_page(pager, limit_conc)
+        fetch_all = st.button('Hent alle konkordanser', help="Deler korpuset i biter som søkes samtidig. Antall treff vises mens bitene hentes, og treffene vises sidevis når alt er hentet.")
+
 if st.session_state.corpus_upload is None:
     with col1:
-        st.markdown("__Korpusstørrelse:__ " + str(len(corpus)) + " dokumenter. " + "Last ned " + get_table_download_link(excel_corpus, link_content="korpusdefinisjon.", filename="corpus.xlsx"), unsafe_allow_html=True)
+        st.markdown("__Korpusstørrelse:__ " + str(len(corpus)) + " dokumenter.", unsafe_allow_html=True)
+        export.export_widget(corpus, "Last ned korpusdefinisjon", "corpus", key="export_corpus")
 else:
     with col1:
         st.markdown("__Korpusstørrelse:__ " + str(len(corpus)) + " dokumenter (__opplastet korpusdefinsjon__). ",  unsafe_allow_html=True)
 
 with col2:
-    st.markdown("__Treff__: " + str(conc.size) + " treff, viser " + str(show_number) + "." + " Last ned " + get_table_download_link(excel_conc, link_content="konkordanser", filename="concordances.xlsx") + ".", unsafe_allow_html=True)
+    status = "alle treff er hentet" if pager.done else "flere kan hentes"
+    st.markdown("__Treff__: viser " + str(len(pager.hits)) + " treff (" + status + ").", unsafe_allow_html=True)
+    export.export_widget(pager.hits, "Last ned konkordanser", "concordances", key="export_conc")
+
+# sort and filter the fetched hits locally
+hits = get_kwic(pager)
+col_sort, col_keyword, col_year = st.columns(3)
+with col_sort:
+    order = st.selectbox("Sorter treff etter", kwic.sort_orders.keys(), index=0)
+with col_keyword:
+    keywords = st.multiselect("Vis bare ordformene", sorted(hits["keyword"].unique()))
+with col_year:
+    years = hits["year"].dropna()
+    if len(years) > 0 and years.min() < years.max():
+        full_range = (int(years.min()), int(years.max()))
+        year_range = st.slider("Årsspenn for treff", *full_range, full_range, help="Treff uten årstall vises bare når hele årsspennet er valgt")
+        # hits without a year are only left out once the range is narrowed
+        if year_range == full_range:
+            year_range = None
+    else:
+        year_range = None
 
-if conc.size > limit_conc:
-    with col3:
-        st.button('Hent flere konkordanser')
+view = kwic.filter_kwic(hits, keywords=keywords, years=year_range)
+if collapse:
+    view = collapse_duplicates(view)
+    view = view.assign(concordance=view.concordance.where(view.copies == 1, view.concordance + " _(" + view.copies.astype(str) + " like treff)_"))
+view = kwic.sort_kwic(view, order)
 
 st.markdown("- - -")
 
-print_concordances(conc)
-
-
-
-
-
+# drawing tens of thousands of hits at once can freeze the browser, so long views are paged
+if len(view) > max_shown_hits:
+    n_pages = (len(view) - 1) // max_shown_hits + 1
+    page = st.number_input(f"Side (av {n_pages})", min_value=1, max_value=n_pages, value=1, help=f"Viser {max_shown_hits} treff per side. Last ned konkordansene for å få alle treffene samlet.")
+    view = view.iloc[(page - 1) * max_shown_hits:page * max_shown_hits]
+print_concordances(view)
+
+if fetch_all:
+    # count the remaining hits as they arrive, then rerun to show them in the paged view and downloads
+    with st.spinner('Henter alle konkordanser...'):
+        fetched = st.empty()
+        try:
+            for hits in pager.fetch_all(shard_size=shard_size, workers=shard_workers):
+                fetched.markdown(f"Har hentet {len(pager.hits)} treff")
+        except:
+            st.error("Konkordanser kunne ikke hentes. Se på parametrene for konkordans eller prøv igjen.")
+            st.stop()
+    st.experimental_rerun()
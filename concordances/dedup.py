@@ -0,0 +1,96 @@
+"""Near-duplicate collapsing of concordances with MinHash and LSH.
+
+Newspaper corpora contain many reprints of the same story. Each concordance
+window gets a MinHash signature over its word shingles; signatures are cut into
+LSH bands, and hits sharing a band bucket with a high enough estimated Jaccard
+similarity are grouped. This runs in roughly linear time instead of comparing
+every pair of hits.
+"""
+import re
+import zlib
+
+import numpy as np
+import pandas as pd
+
+PRIME = (1 << 31) - 1
+MAX_HASH = np.uint64(PRIME)
+
+
+def shingles(text, size=3):
+    """Hashes of the word ``size``-grams of ``text``, ignoring markup and case."""
+    words = re.sub(r"<[^>]+>", " ", text).lower().split()
+    if len(words) < size:
+        grams = [" ".join(words)] if words else []
+    else:
+        grams = [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+    return [zlib.crc32(gram.encode("utf-8")) for gram in grams]
+
+
+def minhash_signatures(texts, num_perm=64, shingle_size=3, seed=0, block=8):
+    """MinHash signature matrix of shape ``(len(texts), num_perm)``.
+
+    Texts without shingles get the maximum hash in every position.
+    """
+    hashed = [shingles(text, shingle_size) for text in texts]
+    lengths = np.array([len(h) for h in hashed])
+    values = np.fromiter((h for hs in hashed for h in hs), dtype=np.uint64, count=lengths.sum())
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    has_shingles = lengths > 0
+
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, PRIME, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, PRIME, size=num_perm, dtype=np.uint64)
+
+    signatures = np.full((len(texts), num_perm), MAX_HASH, dtype=np.uint64)
+    if values.size == 0:
+        return signatures
+    for i in range(0, num_perm, block):
+        permuted = (a[i:i + block, None] * values[None, :] + b[i:i + block, None]) % MAX_HASH
+        minima = np.minimum.reduceat(permuted, starts[has_shingles], axis=1)
+        signatures[has_shingles, i:i + block] = minima.T
+    return signatures
+
+
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def lsh_groups(signatures, bands=16, threshold=0.5):
+    """Group label per row: rows sharing an LSH bucket and agreeing on at least
+    ``threshold`` of their signature are put in the same group.
+    """
+    n, num_perm = signatures.shape
+    rows = num_perm // bands
+    parent = np.arange(n)
+    valid = ~(signatures == MAX_HASH).all(axis=1)
+    for band in range(bands):
+        chunk = signatures[valid, band * rows:(band + 1) * rows]
+        if len(chunk) == 0:
+            break
+        _, first, buckets = np.unique(chunk, axis=0, return_index=True, return_inverse=True)
+        members = np.flatnonzero(valid)
+        leaders = members[first[buckets.ravel()]]
+        candidates = members != leaders
+        similar = (signatures[members[candidates]] == signatures[leaders[candidates]]).mean(axis=1) >= threshold
+        for i, j in zip(members[candidates][similar], leaders[candidates][similar]):
+            root_i, root_j = _find(parent, i), _find(parent, j)
+            if root_i != root_j:
+                parent[max(root_i, root_j)] = min(root_i, root_j)
+    return np.array([_find(parent, i) for i in range(n)])
+
+
+def collapse(hits, text_column="concordance", **kwargs):
+    """One representative per group of near-duplicate hits, in the original order.
+
+    The first hit of each group is kept and a ``copies`` column holds the
+    size of its group. Extra keyword arguments go to :func:`lsh_groups`.
+    """
+    if len(hits) == 0:
+        return hits.assign(copies=pd.Series(dtype=int))
+    groups = lsh_groups(minhash_signatures(hits[text_column].tolist()), **kwargs)
+    copies = np.bincount(groups, minlength=len(hits))
+    keep = groups == np.arange(len(hits))
+    return hits[keep].assign(copies=copies[keep])
@@ -0,0 +1,68 @@
+"""On-demand table exports as Excel, CSV or Parquet.
+
+Files are only built when the user asks for one, and Excel files are written
+row by row through xlsxwriter's ``constant_memory`` mode instead of holding the
+whole sheet in memory.
+"""
+from io import BytesIO
+
+import pandas as pd
+import streamlit as st
+import xlsxwriter
+
+formats = {
+    "Excel": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "CSV": ("csv", "text/csv"),
+    "Parquet": ("parquet", "application/octet-stream"),
+}
+
+
+def to_xlsx(df):
+    """Write ``df`` to xlsx bytes, streaming one row at a time."""
+    output = BytesIO()
+    workbook = xlsxwriter.Workbook(output, {"constant_memory": True, "nan_inf_to_errors": True})
+    worksheet = workbook.add_worksheet("Sheet1")
+    worksheet.write_row(0, 0, [str(column) for column in df.columns])
+    values = df.astype(object).where(df.notna(), None)
+    for i, row in enumerate(values.itertuples(index=False, name=None), start=1):
+        worksheet.write_row(i, 0, row)
+    workbook.close()
+    return output.getvalue()
+
+
+def to_csv(df):
+    return df.to_csv(index=False).encode("utf-8")
+
+
+def to_parquet(df):
+    """Write ``df`` to Parquet bytes; mixed object columns are stored as strings."""
+    df = df.copy()
+    for column in df.columns[df.dtypes == object]:
+        df[column] = df[column].where(df[column].isna(), df[column].astype(str))
+    output = BytesIO()
+    df.to_parquet(output, index=False)
+    return output.getvalue()
+
+
+writers = {"Excel": to_xlsx, "CSV": to_csv, "Parquet": to_parquet}
+
+
+def frame_token(df):
+    """Cheap content fingerprint, used to tell whether a built file is still current."""
+    return (df.shape, int(pd.util.hash_pandas_object(df, index=False).sum()))
+
+
+def export_widget(df, label, filename, key):
+    """Expander with a format choice and a button that builds the file only when asked for.
+
+    The built file is kept in session state until ``df`` or the format changes.
+    """
+    with st.expander(label):
+        fmt = st.selectbox("Format", formats.keys(), key=f"{key}_format")
+        if st.button("Lag fil", key=f"{key}_build"):
+            with st.spinner("Lager fil..."):
+                st.session_state[key] = ((frame_token(df), fmt), writers[fmt](df))
+        built = st.session_state.get(key)
+        if built is not None and built[0] == (frame_token(df), fmt):
+            extension, mime = formats[fmt]
+            st.download_button("Last ned", built[1], file_name=f"{filename}.{extension}", mime=mime, key=f"{key}_download")
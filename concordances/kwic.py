@@ -0,0 +1,83 @@
+"""Columnar keyword-in-context store for fetched concordances.
+
+Hits are parsed once from the annotated ``concordance`` strings into separate
+left context, keyword and right context columns, so sorting and filtering run
+locally on the fetched hits instead of as new queries.
+"""
+import numpy as np
+import pandas as pd
+
+kwic_columns = ['urn', 'concordance', 'left', 'keyword', 'right', 'year']
+
+# sort orders offered in the app: context side and word position from the keyword
+sort_orders = {
+    "Rekkefølge i korpuset": None,
+    "Nøkkelord": ("keyword", 0),
+    "1. ord til venstre": ("left", 1),
+    "2. ord til venstre": ("left", 2),
+    "1. ord til høyre": ("right", 1),
+    "2. ord til høyre": ("right", 2),
+}
+
+
+def parse_kwic(hits, index=None):
+    """Split annotated concordances into left context, keyword and right context.
+
+    The first ``<b>`` span is the keyword; any later ones stay marked in the
+    right context.
+
+    :param hits: frame with ``urn`` and ``concordance`` columns
+    :param index: optional corpus metadata indexed by URN with a ``year`` column
+    """
+    parts = hits["concordance"].str.extract(r"^(?P<left>.*?)<b>(?P<keyword>.*?)</b>(?P<right>.*)$", expand=True)
+    parts["left"] = parts["left"].fillna(hits["concordance"]).str.strip()
+    parts["keyword"] = parts["keyword"].fillna("").str.strip()
+    parts["right"] = parts["right"].fillna("").str.strip()
+
+    kwic = pd.concat([hits[["urn", "concordance"]], parts], axis=1)
+    if index is not None and "year" in index:
+        kwic["year"] = pd.to_numeric(index["year"].reindex(hits["urn"]), errors="coerce").to_numpy()
+    else:
+        kwic["year"] = np.nan
+    return kwic[kwic_columns]
+
+
+def extend_kwic(kwic, hits, index=None):
+    """Parse the hits that are not yet in ``kwic``; hits are only ever appended."""
+    if kwic is None or len(kwic) > len(hits):
+        return parse_kwic(hits, index)
+    if len(kwic) == len(hits):
+        return kwic
+    return pd.concat([kwic, parse_kwic(hits.iloc[len(kwic):], index)])
+
+
+def context_word(kwic, side, position):
+    """Lowercased word at ``position`` from the keyword on ``side``, '' where the context is shorter."""
+    if side == "keyword":
+        return kwic["keyword"].str.lower()
+    words = kwic[side].str.replace(r"</?b>", "", regex=True).str.lower().str.split()
+    return words.str[-position if side == "left" else position - 1].fillna("")
+
+
+def sort_kwic(kwic, order):
+    """Sort by one of :data:`sort_orders`, breaking ties with the next word outwards."""
+    if sort_orders.get(order) is None:
+        return kwic
+    side, position = sort_orders[order]
+    keys = pd.DataFrame({"first": context_word(kwic, side, position)}, index=kwic.index)
+    if side != "keyword":
+        keys["second"] = context_word(kwic, side, position + 1)
+    return kwic.loc[keys.sort_values(by=list(keys.columns), kind="stable").index]
+
+
+def filter_kwic(kwic, keywords=None, years=None):
+    """Keep hits whose keyword form is in ``keywords`` and whose year is within ``years``.
+
+    With ``years`` hits without a year are left out, so only pass it when the range is narrowed.
+    """
+    mask = np.ones(len(kwic), dtype=bool)
+    if keywords:
+        mask &= kwic["keyword"].isin(keywords).to_numpy()
+    if years is not None:
+        mask &= kwic["year"].between(*years).to_numpy()
+    return kwic[mask]
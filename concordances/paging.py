@@ -0,0 +1,140 @@
+"""Paged and sharded concordance retrieval.
+
+The concordance API has no offset, so a :class:`ConcordancePager` keeps a
+cursor into the corpus' URN list instead. Each request covers the next chunk
+of URNs; hits beyond the requested page are buffered for the next page, so
+nothing is skipped and no chunk is queried twice.
+
+For large corpora the remaining URNs can be split into shards that are
+queried concurrently over a pooled HTTP session (:func:`fetch_shards`).
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from dhlab.constants import BASE_URL
+
+columns = ['urn', 'concordance']
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session(pool_size=8):
+    """HTTP session shared by all threads, with a connection pool of ``pool_size``."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+    return _session
+
+
+def query_concordance(urns, query, window=20, limit=5000):
+    """Concordances for ``query`` in ``urns`` as a frame with ``urn`` and ``concordance`` columns.
+
+    Same endpoint as ``dhlab.api.dhlab_api.concordance``, but over the pooled session.
+    """
+    r = get_session().post(f"{BASE_URL}/conc", json={"urns": urns, "query": query, "window": window, "limit": limit})
+    r.raise_for_status()
+    result = pd.DataFrame(r.json())
+    if len(result) == 0:
+        return pd.DataFrame(columns=columns)
+    return result[['urn', 'conc']].rename(columns={'conc': 'concordance'})
+
+
+def fetch_shards(shards, query, window=20, limit=5000, workers=8):
+    """Query each list of URNs in ``shards`` concurrently.
+
+    Yields ``(shard, hits)`` in shard order: a finished shard is yielded as
+    soon as all shards before it are done, so results stream in order.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(query_concordance, shard, query, window=window, limit=limit): i
+            for i, shard in enumerate(shards)
+        }
+        finished = {}
+        next_shard = 0
+        try:
+            for future in as_completed(futures):
+                finished[futures[future]] = future.result()
+                while next_shard in finished:
+                    yield shards[next_shard], finished.pop(next_shard)
+                    next_shard += 1
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+class ConcordancePager:
+    """Cursor over the URNs of a corpus that fetches concordances on demand.
+
+    :param urns: URNs of the corpus, in the order they are searched
+    :param query: concordance query
+    :param window: number of words around the hit
+    :param chunk_size: number of URNs in the first request; doubled while
+        chunks come back with fewer hits than a page, up to ``max_chunk_size``
+    :param limit: max. number of hits per request
+    """
+
+    def __init__(self, urns, query, window=20, chunk_size=50, max_chunk_size=1600, limit=5000):
+        self.urns = list(urns)
+        self.query = query
+        self.window = window
+        self.chunk_size = chunk_size
+        self.max_chunk_size = max_chunk_size
+        self.limit = limit
+        self.cursor = 0
+        self.hits = pd.DataFrame(columns=columns)
+        self._buffer = pd.DataFrame(columns=columns)
+
+    @property
+    def exhausted(self):
+        """All URNs have been searched."""
+        return self.cursor >= len(self.urns)
+
+    @property
+    def done(self):
+        """All hits have been shown."""
+        return self.exhausted and self._buffer.empty
+
+    def _fetch_chunk(self):
+        urns = self.urns[self.cursor:self.cursor + self.chunk_size]
+        chunk = query_concordance(urns, self.query, window=self.window, limit=self.limit)
+        self.cursor += len(urns)
+        return chunk
+
+    def next_page(self, page_size=10):
+        """Fetch and return the next ``page_size`` hits, appending them to :attr:`hits`."""
+        while len(self._buffer) < page_size and not self.exhausted:
+            chunk = self._fetch_chunk()
+            if len(chunk) < page_size:
+                self.chunk_size = min(self.chunk_size * 2, self.max_chunk_size)
+            self._buffer = pd.concat([self._buffer, chunk], ignore_index=True)
+
+        page = self._buffer.iloc[:page_size]
+        self._buffer = self._buffer.iloc[page_size:]
+        self.hits = pd.concat([self.hits, page], ignore_index=True)
+        return page
+
+    def fetch_all(self, shard_size=200, workers=8):
+        """Fetch all remaining hits, querying shards of ``shard_size`` URNs concurrently.
+
+        Yields the new hits in URN order as they become available; each batch
+        is appended to :attr:`hits` and the cursor moves past its shard.
+        """
+        if not self._buffer.empty:
+            page, self._buffer = self._buffer, pd.DataFrame(columns=columns)
+            self.hits = pd.concat([self.hits, page], ignore_index=True)
+            yield page
+
+        shards = [self.urns[i:i + shard_size] for i in range(self.cursor, len(self.urns), shard_size)]
+        for shard, hits in fetch_shards(shards, self.query, window=self.window, limit=self.limit, workers=workers):
+            self.cursor += len(shard)
+            self.hits = pd.concat([self.hits, hits], ignore_index=True)
+            yield hits
@@ -0,0 +1,47 @@
+"""Vectorized rendering of concordances with document metadata.
+
+Shared by the concordance and collocation apps: concordance rows are joined
+to the corpus through a URN index and turned into markdown in one pass, so
+the page gets all hits in a single ``st.markdown`` call.
+"""
+import pandas as pd
+
+metadata_columns = ['title', 'authors', 'year', 'timestamp']
+
+
+def urn_index(corpus):
+    """Corpus metadata indexed by URN, with missing columns filled in."""
+    return corpus.drop_duplicates("urn").set_index("urn").reindex(columns=metadata_columns)
+
+
+def _as_text(values):
+    """Numbers as integer strings, missing values as empty strings."""
+    numbers = pd.to_numeric(values, errors="coerce").astype("Int64")
+    return numbers.astype(str).where(numbers.notna(), "")
+
+
+def concordance_lines(conc, index):
+    """Markdown line per concordance row: a link with title, authors and date, then the hit.
+
+    :param conc: frame with ``urn`` and ``concordance`` columns
+    :param index: frame from :func:`urn_index`
+    """
+    urns = conc["urn"].astype(str)
+    metadata = index.reindex(urns)
+    metadata.index = conc.index
+    # newspapers are dated by timestamp, other documents by year
+    when = metadata["timestamp"].where(urns.str.contains("digavis"), metadata["year"])
+
+    link = (
+        "<a href='https://urn.nb.no/" + urns + "' target='_blank'>"
+        + metadata["title"].astype(object).fillna("").astype(str) + " – "
+        + metadata["authors"].astype(object).fillna("").astype(str) + " – "
+        + _as_text(when) + "</a>"
+    )
+    text = conc["concordance"].str.replace("<b>", "**", regex=False).str.replace("</b>", "**", regex=False)
+    return link + " " + text
+
+
+def concordance_markdown(conc, index):
+    """All concordance lines as one markdown string."""
+    return "\n\n".join(concordance_lines(conc, index))
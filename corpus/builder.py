@@ -0,0 +1,248 @@
+"""Year-sharded corpus builder for corpora larger than one query can return.
+
+The corpus query is split into one shard per year range (and per doctype),
+and the shards are fetched concurrently over a pooled HTTP session with a
+bounded number of workers. Each shard is written to its own Parquet file as
+soon as it arrives, so the full corpus is never held in memory while it is
+being fetched.
+
+With ``order_by="random"`` every shard is sampled at random, and the final
+corpus is a stratified sample with each shard contributing in proportion to
+its size. Each shard first asks only for its share of the corpus, with some
+headroom: in proportion to the document counts per year from the local
+catalog when there is one, evenly otherwise. Shards that come back full are
+topped up once. Without the catalog the API gives no shard sizes, so a full
+shard is then fetched again up to the shard limit to learn its size. With ``"first"``
+the shards are kept in year order and fetching stops once the leading shards
+hold enough documents. Rank order cannot be sharded: the relevance scores are
+not returned, so shards cannot be merged by rank.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from dhlab.constants import BASE_URL
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session(pool_size=8):
+    """HTTP session shared by all threads, with a connection pool of ``pool_size``."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+    return _session
+
+
+def query_corpus(params):
+    """One corpus query, same endpoint and parameters as ``dhlab.Corpus``; ``None`` values are left out."""
+    r = get_session().post(BASE_URL + "/build_corpus", json={k: v for k, v in params.items() if v is not None})
+    r.raise_for_status()
+    return pd.DataFrame(r.json())
+
+
+def year_shards(from_year, to_year, years_per_shard=1):
+    """Consecutive ``(from_year, to_year)`` ranges covering both ends."""
+    return [
+        (start, min(start + years_per_shard - 1, to_year))
+        for start in range(from_year, to_year + 1, years_per_shard)
+    ]
+
+
+def shard_limits(limit, weights, shard_limit, headroom=1.25, minimum=100):
+    """Per-shard query limits for a random sample of ``limit`` documents.
+
+    Each shard asks for its share of ``limit`` in proportion to ``weights``
+    (the expected number of documents in it), times ``headroom``, but at
+    least ``minimum`` in case the weights are out of date and at most
+    ``shard_limit``.
+    """
+    weights = np.asarray(weights, dtype=float)
+    if weights.sum() <= 0:
+        return np.full(len(weights), min(limit, shard_limit), dtype=int)
+    shares = np.ceil(limit * headroom * weights / weights.sum()).astype(int)
+    return np.clip(shares, min(minimum, shard_limit), shard_limit)
+
+
+def allocate(sizes, n):
+    """Proportional allocation of ``n`` samples over strata of ``sizes`` (largest remainder)."""
+    sizes = np.asarray(sizes, dtype=int)
+    total = sizes.sum()
+    if total <= n:
+        return sizes
+    quotas = sizes * n / total
+    counts = np.floor(quotas).astype(int)
+    order = np.argsort(-(quotas - counts), kind="stable")
+    counts[order[:n - counts.sum()]] += 1
+    return counts
+
+
+class ShardedCorpus:
+    """A corpus query split into year and doctype shards, stored as Parquet files in ``directory``.
+
+    :param directory: where the shard files are written
+    :param params: corpus query parameters as for ``dhlab.Corpus``, without years, limit and order
+    :param from_year: first year of the corpus
+    :param to_year: last year of the corpus
+    :param doctypes: doctypes to shard over, defaults to ``params["doctype"]``
+    :param years_per_shard: number of years in each shard
+    :param shard_limit: max. number of documents fetched per shard
+    """
+
+    def __init__(self, directory, params, from_year, to_year, doctypes=None, years_per_shard=1, shard_limit=20000):
+        self.directory = directory
+        self.shard_limit = shard_limit
+        doctypes = doctypes or [params.get("doctype")]
+        self.queries = [
+            dict(params, doctype=doctype, from_year=start, to_year=end)
+            for doctype in doctypes
+            for start, end in year_shards(from_year, to_year, years_per_shard)
+        ]
+        self.sizes = {}
+        self.limits = [shard_limit] * len(self.queries)
+        self.expected = None
+
+    def path(self, shard):
+        return os.path.join(self.directory, f"shard-{shard:05d}.parquet")
+
+    def _write(self, shard, frame):
+        if len(frame) > 0:
+            tmp = self.path(shard) + ".tmp"
+            frame.to_parquet(tmp, index=False)
+            os.replace(tmp, self.path(shard))
+        self.sizes[shard] = len(frame)
+
+    def _leading_size(self):
+        """Number of documents in the unbroken run of fetched shards from the first one."""
+        total = 0
+        for shard in range(len(self.queries)):
+            if shard not in self.sizes:
+                break
+            total += self.sizes[shard]
+        return total
+
+    def _expected_sizes(self, year_counts):
+        """Expected number of documents in each shard, summed from ``{year: count}``."""
+        return [
+            sum(year_counts.get(year, 0) for year in range(query["from_year"], query["to_year"] + 1))
+            for query in self.queries
+        ]
+
+    def _estimated_sizes(self):
+        """Size of each fetched shard as used for the stratified sample.
+
+        A shard that came back short holds all its documents. A full one holds
+        at least what was fetched, and is taken to hold its expected size when
+        that is known.
+        """
+        sizes = {}
+        for shard, size in self.sizes.items():
+            full = size >= self.limits[shard]
+            if full and self.expected is not None:
+                size = max(size, min(self.expected[shard], self.shard_limit))
+            sizes[shard] = size
+        return sizes
+
+    def _top_up(self, limit):
+        """New limits for shards that came back full and are needed beyond what they hold.
+
+        Without expected sizes the corpus API gives no way to tell how large a
+        full shard is, so it is fetched again at ``shard_limit``. With them, a
+        full shard is only fetched again when its share of the sample is more
+        than it fetched.
+        """
+        shards = sorted(self.sizes)
+        sizes = self._estimated_sizes()
+        shares = dict(zip(shards, allocate([sizes[shard] for shard in shards], limit)))
+        limits = {}
+        for shard in shards:
+            if self.sizes[shard] < self.limits[shard] or self.limits[shard] >= self.shard_limit:
+                continue
+            if self.expected is None:
+                limits[shard] = self.shard_limit
+            elif shares[shard] > self.sizes[shard]:
+                limits[shard] = int(min(np.ceil(shares[shard] * 1.25), self.shard_limit))
+        return limits
+
+    def fetch(self, limit, order_by="first", workers=8, year_counts=None):
+        """Fetch the shards concurrently, writing each to disk as it arrives.
+
+        Yields ``(done, total)`` after each shard request. Unless the order is
+        random, fetching stops once the leading shards hold ``limit`` documents.
+
+        In random order each shard first asks only for its share of ``limit``,
+        in proportion to ``year_counts`` or evenly without them, and shards
+        that come back full are topped up once (see :meth:`_top_up`).
+
+        :param year_counts: expected number of documents per year as ``{year: count}``
+        """
+        if order_by == "rank":
+            raise ValueError("Rank order cannot be merged across shards")
+        self.expected = self._expected_sizes(year_counts) if year_counts is not None else None
+        if order_by != "random":
+            self.limits = [min(limit, self.shard_limit)] * len(self.queries)
+        else:
+            self.limits = list(shard_limits(limit, self.expected or [1] * len(self.queries), self.shard_limit))
+        pending = list(range(len(self.queries)))
+        done, total, first_round = 0, len(pending), True
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while pending:
+                futures = {
+                    pool.submit(query_corpus, dict(self.queries[shard], limit=int(self.limits[shard]), order_by=order_by)): shard
+                    for shard in pending
+                }
+                try:
+                    for future in as_completed(futures):
+                        self._write(futures[future], future.result())
+                        done += 1
+                        yield done, total
+                        if order_by != "random" and self._leading_size() >= limit:
+                            return
+                finally:
+                    for future in futures:
+                        future.cancel()
+                top_up = self._top_up(limit) if order_by == "random" and first_round else {}
+                first_round = False
+                for shard, shard_limit in top_up.items():
+                    self.limits[shard] = shard_limit
+                pending = sorted(top_up)
+                total += len(pending)
+
+    def _read(self, shard):
+        return pd.read_parquet(self.path(shard))
+
+    def load(self, limit, order_by="first", seed=None):
+        """The fetched corpus, at most ``limit`` documents.
+
+        For random order this is a sample stratified over the shards by their
+        estimated sizes (see :meth:`_estimated_sizes`), taking no more from a
+        shard than it holds.
+        """
+        shards = sorted(shard for shard, size in self.sizes.items() if size > 0)
+        if order_by == "random":
+            sizes = self._estimated_sizes()
+            counts = allocate([sizes[shard] for shard in shards], limit)
+            counts = np.minimum(counts, [self.sizes[shard] for shard in shards])
+            frames = [
+                self._read(shard).sample(n=count, random_state=seed)
+                for shard, count in zip(shards, counts) if count > 0
+            ]
+        else:
+            frames, total = [], 0
+            for shard in shards:
+                if total >= limit:
+                    break
+                frames.append(self._read(shard))
+                total += len(frames[-1])
+        if not frames:
+            return pd.DataFrame(columns=["urn"])
+        return pd.concat(frames, ignore_index=True).head(limit)
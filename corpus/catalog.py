@@ -0,0 +1,173 @@
+"""Local SQLite catalog of document metadata for instant corpus filtering.
+
+The catalog is filled from a metadata dump (Parquet or CSV, one row per
+document with a ``dhlabid``) and synced incrementally: only rows with a
+``dhlabid`` above the highest one already stored are read in. Metadata-only
+corpus definitions can then be counted and built locally instead of through a
+remote query; full-text searches still need the API.
+
+Sync from the command line with::
+
+    python catalog.py metadata.parquet [catalog.sqlite]
+"""
+import os
+import sqlite3
+import sys
+import threading
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+default_path = "catalog.sqlite"
+
+columns = {
+    "dhlabid": "INTEGER PRIMARY KEY",
+    "urn": "TEXT",
+    "doctype": "TEXT",
+    "title": "TEXT",
+    "authors": "TEXT",
+    "city": "TEXT",
+    "timestamp": "INTEGER",
+    "year": "INTEGER",
+    "publisher": "TEXT",
+    "ddc": "TEXT",
+    "subjects": "TEXT",
+    "langs": "TEXT",
+}
+
+indexes = {
+    "doctype_year": ("doctype", "year"),
+    "year": ("year",),
+    "ddc": ("ddc",),
+    "langs": ("langs",),
+    "subjects": ("subjects",),
+}
+
+
+def _dump_batches(path, batch_size):
+    if path.endswith(".parquet"):
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=batch_size, keep_default_na=False)
+
+
+def _pattern(term, contains):
+    """SQL LIKE pattern for a search term where ``*`` truncates."""
+    term = term.strip().replace("*", "%")
+    return f"%{term}%" if contains else term
+
+
+def _expression(column, expression, contains=True):
+    """SQL condition for a search expression combining terms with OR and AND.
+
+    AND binds tighter than OR, as in ``364* OR 916* AND 9*``.
+    """
+    alternatives, params = [], []
+    for alternative in expression.split(" OR "):
+        terms = [term for term in alternative.split(" AND ") if term.strip()]
+        if terms:
+            alternatives.append(" AND ".join(f"{column} LIKE ?" for _ in terms))
+            params.extend(_pattern(term, contains) for term in terms)
+    if not alternatives:
+        return None, []
+    return "(" + " OR ".join(f"({a})" for a in alternatives) + ")", params
+
+
+class Catalog:
+    """Document metadata in a SQLite file at ``path``, queried with the corpus app's filters."""
+
+    def __init__(self, path=default_path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                + ", ".join(f"{name} {kind}" for name, kind in columns.items()) + ")"
+            )
+            for name, indexed in indexes.items():
+                self.connection.execute(f"CREATE INDEX IF NOT EXISTS idx_{name} ON documents ({', '.join(indexed)})")
+
+    @property
+    def watermark(self):
+        """Highest ``dhlabid`` in the catalog, 0 when empty."""
+        with self._lock:
+            return self.connection.execute("SELECT COALESCE(MAX(dhlabid), 0) FROM documents").fetchone()[0]
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def sync(self, dump, batch_size=50000):
+        """Add the documents in ``dump`` that are newer than :attr:`watermark`; returns the number added."""
+        watermark = self.watermark
+        added = 0
+        for batch in _dump_batches(dump, batch_size):
+            batch = batch[pd.to_numeric(batch["dhlabid"], errors="coerce") > watermark]
+            if len(batch) == 0:
+                continue
+            batch = batch.reindex(columns=list(columns))
+            rows = batch.astype(object).where(batch.notna(), None).itertuples(index=False, name=None)
+            with self._lock, self.connection:
+                self.connection.executemany(
+                    f"INSERT OR REPLACE INTO documents VALUES ({', '.join('?' * len(columns))})", rows
+                )
+            added += len(batch)
+        return added
+
+    def _where(self, doctype=None, author=None, title=None, ddk=None, subject=None, lang=None,
+               from_year=None, to_year=None):
+        conditions, params = [], []
+        if doctype:
+            conditions.append("doctype = ?")
+            params.append(doctype)
+        if from_year is not None:
+            conditions.append("year >= ?")
+            params.append(from_year)
+        if to_year is not None:
+            conditions.append("year <= ?")
+            params.append(to_year)
+        for column, expression, contains in [
+            ("authors", author, True),
+            ("title", title, True),
+            ("ddc", ddk, False),
+            ("subjects", subject, True),
+            ("langs", lang, True),
+        ]:
+            if expression:
+                condition, values = _expression(column, expression, contains)
+                if condition:
+                    conditions.append(condition)
+                    params.extend(values)
+        return (" WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+    def count(self, **filters):
+        """Number of documents matching ``filters``."""
+        where, params = self._where(**filters)
+        with self._lock:
+            return self.connection.execute(f"SELECT COUNT(*) FROM documents{where}", params).fetchone()[0]
+
+    def year_counts(self, **filters):
+        """Number of documents matching ``filters`` per year, as ``{year: count}``."""
+        where, params = self._where(**filters)
+        with self._lock:
+            rows = self.connection.execute(f"SELECT year, COUNT(*) FROM documents{where} GROUP BY year", params)
+            return {year: count for year, count in rows if year is not None}
+
+    def query(self, limit=None, order_by="first", **filters):
+        """Documents matching ``filters`` as a frame, at most ``limit``, in ``dhlabid`` or random order."""
+        where, params = self._where(**filters)
+        order = " ORDER BY RANDOM()" if order_by == "random" else " ORDER BY dhlabid"
+        sql = f"SELECT * FROM documents{where}{order}"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params = params + [int(limit)]
+        with self._lock:
+            return pd.read_sql_query(sql, self.connection, params=params)
+
+
+if __name__ == "__main__":
+    catalog = Catalog(sys.argv[2] if len(sys.argv) > 2 else default_path)
+    added = catalog.sync(sys.argv[1])
+    print(f"{added} new documents, {len(catalog)} in {os.path.abspath(catalog.path)}")
@@ -3,7 +3,6 @@ from collections import Counter
 import streamlit as st
 #import spacy_streamlit
 
-import pandas as pd
 from PIL import Image
 import urllib
 
@@ -16,25 +15,45 @@ import dhlab as dh
 import dhlab.api.dhlab_api as api
 from dhlab.text.nbtokenizer import tokenize
 # for excelnedlastning
-from io import BytesIO
+import os
+import tempfile
+import corpusdef
+import builder
+import preview
+import catalog
 
 st.set_page_config(page_title="Korpus", page_icon=None, layout="wide", initial_sidebar_state="auto", menu_items=None)
 
 
-max_size_corpus = 20000
-max_rows = 1200
-min_rows = 800
-default_size = 10 # percent of max_size_corpus
-
-def to_excel(df):
-    """Make an excel object out of a dataframe as an IO-object"""
-    output = BytesIO()
-    writer = pd.ExcelWriter(output, engine='openpyxl')
-    df.to_excel(writer, index=False, sheet_name='Sheet1')
-    worksheet = writer.sheets['Sheet1']
-    writer.save()
-    processed_data = output.getvalue()
-    return processed_data
+max_size_corpus = 200000
+single_query_limit = 20000 # larger corpora are fetched in year shards
+build_workers = 8
+page_size = 100 # rows in the corpus preview
+default_size = 1 # percent of max_size_corpus
+
+catalog_path = os.environ.get("DHLAB_CATALOG", catalog.default_path)
+metadata_dump = os.environ.get("DHLAB_METADATA_DUMP")
+
+@st.cache_resource(ttl=3600)
+def get_catalog():
+    """Local metadata catalog, synced from the metadata dump if one is configured; None if there is neither"""
+    if metadata_dump is None and not os.path.exists(catalog_path):
+        return None
+    local = catalog.Catalog(catalog_path)
+    if metadata_dump is not None:
+        local.sync(metadata_dump)
+    return local
+
+def build_large_corpus(params, from_year, to_year, limit, order_by, year_counts=None):
+    """Fetch a corpus larger than a single query can return, one shard per year, with a progress bar"""
+    progress = st.progress(0)
+    with tempfile.TemporaryDirectory(prefix="korpus-") as directory:
+        sharded = builder.ShardedCorpus(directory, params, from_year, to_year, shard_limit=single_query_limit)
+        for done, total in sharded.fetch(limit, order_by=order_by, workers=build_workers, year_counts=year_counts):
+            progress.progress(done / total)
+        corpus = sharded.load(limit, order_by=order_by)
+    progress.empty()
+    return dh.Corpus.from_df(corpus)
 
 def v(x):
     if x != "":
@@ -131,17 +150,40 @@ with colf:
                             )
 
 
-df_defined = False
+if doctype in ['digimanus']:
+    params = dict(doctype=v(doctype))
+    columns = ['urn','title']
+elif doctype in ['digavis']:
+    params = dict(doctype=v(doctype), fulltext= v(fulltext), title=v(title))
+    columns = ['urn','title', 'year', 'timestamp', 'city']
+elif doctype in ['digitidsskrift']:
+    params = dict(doctype=v(doctype), author=v(author), fulltext=v(fulltext), title=v(title), subject=v(subject), ddk= v(ddk), lang=lang)
+    columns = ['dhlabid', 'urn', 'title','city','timestamp','year', 'publisher', 'ddc', 'langs']
+elif doctype in ['digistorting']:
+    params = dict(doctype=v(doctype), fulltext=v(fulltext))
+    columns = ['dhlabid', 'urn', 'year']
+else:
+    params = dict(doctype=v(doctype), author=v(author), fulltext=v(fulltext), title=v(title), subject=v(subject), ddk= v(ddk), lang=lang)
+    columns = ['dhlabid', 'urn', 'authors', 'title','city','timestamp','year', 'publisher', 'ddc','subjects', 'langs']
+
+# metadata-only definitions can be counted and built from the local catalog
+local_catalog = get_catalog()
+catalog_filters = {key: value for key, value in params.items() if key != 'fulltext'}
+if doctype not in ['digimanus']:
+    catalog_filters.update(from_year = years[0], to_year = years[1])
+use_catalog = local_catalog is not None and params.get('fulltext') is None
+
 st.write("---")
 st.subheader("Lag korpuset og last ned") ######################################################################
 
-
+if use_catalog:
+    st.markdown(f"{local_catalog.count(**catalog_filters)} dokumenter i den lokale katalogen passer til definisjonen")
 
 with st.form(key='my_form'): 
     
     colx, col_order,coly = st.columns([2,2,4])
     with colx:
-        limit = st.number_input(f"Maks antall, inntil {max_size_corpus}", min_value=1, max_value = max_size_corpus, value = int(default_size*max_size_corpus/100))
+        limit = st.number_input(f"Maks antall, inntil {max_size_corpus}", min_value=1, max_value = max_size_corpus, value = int(default_size*max_size_corpus/100), help=f"Korpus på over {single_query_limit} dokumenter hentes år for år i parallell, unntatt med metoden 'rank', som gir høyst {single_query_limit} dokumenter")
     with col_order:
         ordertype = st.selectbox("Metode for uthenting", ['first', 'rank', 'random'], help="Metode 'first' er raskest, og velger dokument etter hvert som de blir funnet, mens'rank' gir en rask ordning på dokumenter om korpuset er definert med et fulltekstsøk og sorterer på relevans, siste valg er 'random' som først samler inn hele korpuset og gjør et vilkårlig utvalg av tekster derfra.")
     with coly:
@@ -150,32 +192,65 @@ with st.form(key='my_form'):
     submit_button = st.form_submit_button(label = "Trykk her når korpusdefinisjonen er klar")
     
     if submit_button:
-        if doctype in ['digimanus']:
-            df = dh.Corpus(doctype=v(doctype), limit=limit, order_by = ordertype)
-            columns = ['urn','title']
-        elif doctype in ['digavis']:
-            df = dh.Corpus(doctype=v(doctype), fulltext= v(fulltext), from_year = years[0], to_year = years[1], title=v(title), limit=limit, order_by = ordertype)
-            columns = ['urn','title', 'year', 'timestamp', 'city']
-        elif doctype in ['digitidsskrift']:
-            df = dh.Corpus(doctype=v(doctype), author=v(author), fulltext=v(fulltext), from_year = years[0], to_year = years[1], title=v(title), subject=v(subject), ddk= v(ddk), lang=lang, limit=limit, order_by = ordertype)
-            columns = ['dhlabid', 'urn', 'title','city','timestamp','year', 'publisher', 'ddc', 'langs']
-        elif doctype in ['digistorting']:
-            df = dh.Corpus(doctype=v(doctype), fulltext=v(fulltext), from_year = years[0], to_year = years[1], limit=limit, order_by = ordertype)
-            columns = ['dhlabid', 'urn', 'year']
+        if use_catalog:
+            df = dh.Corpus.from_df(local_catalog.query(limit=limit, order_by=ordertype, **catalog_filters))
+        elif doctype in ['digimanus']:
+            df = dh.Corpus(limit=limit, order_by = ordertype, **params)
+        elif limit > single_query_limit and ordertype == 'rank':
+            # rank order cannot be merged across year shards, so it is limited to one query
+            st.info(f"Med metoden 'rank' hentes høyst {single_query_limit} dokumenter, fordi rangeringen ikke kan slås sammen på tvers av år")
+            df = dh.Corpus(from_year = years[0], to_year = years[1], limit=single_query_limit, order_by = ordertype, **params)
+        elif limit > single_query_limit:
+            # the local catalog tells how many documents each year has, so random shards only ask for their share
+            year_counts = local_catalog.year_counts(**catalog_filters) if local_catalog is not None else None
+            df = build_large_corpus(params, years[0], years[1], limit, ordertype, year_counts=year_counts)
         else:
-            df = dh.Corpus(doctype=v(doctype), author=v(author), fulltext=v(fulltext), from_year = years[0], to_year = years[1], title=v(title), subject=v(subject), ddk= v(ddk), lang=lang, limit=limit, order_by = ordertype)
-            columns = ['dhlabid', 'urn', 'authors', 'title','city','timestamp','year', 'publisher', 'ddc','subjects', 'langs']
-        
-        st.markdown(f"Fant totalt {df.size} dokumenter")
-            
-        if df.size >= max_rows:
-            st.markdown(f"Viser {min_rows} rader.")
-            st.dataframe(df.corpus.sample(min(min_rows, max_rows)))
-        else:
-            st.dataframe(df.corpus[columns])
-        df_defined = True
-        
-    
-if df_defined:
-    if st.download_button('Last ned data i excelformat', to_excel(df.corpus), filnavn, help = "Åpnes i Excel eller tilsvarende"):
-        pass
\ No newline at end of file
+            df = dh.Corpus(from_year = years[0], to_year = years[1], limit=limit, order_by = ordertype, **params)
+
+        # the corpus and everything derived from it is kept for browsing between reruns
+        st.session_state.corpus = df.corpus
+        st.session_state.corpus_columns = columns
+        st.session_state.corpus_facets = preview.facets(df.corpus)
+        st.session_state.sort_orders = {}
+        st.session_state.corpus_files = (
+            corpusdef.to_excel(df.corpus) if df.size <= single_query_limit else None,
+            corpusdef.to_parquet(df.corpus)
+        )
+
+
+if "corpus" in st.session_state:
+    corpus = st.session_state.corpus
+    st.markdown(f"Fant totalt {len(corpus)} dokumenter")
+
+    corpus_facets = st.session_state.corpus_facets
+    col_years, col_facets = st.columns([3,1])
+    with col_years:
+        if "year" in corpus_facets:
+            st.bar_chart(corpus_facets["year"])
+    with col_facets:
+        for facet, label in [("doctype", "Dokumenttype"), ("langs", "Språk")]:
+            if facet in corpus_facets:
+                st.dataframe(corpus_facets[facet].rename_axis(label).rename("Antall"))
+
+    visible_columns = [column for column in st.session_state.corpus_columns if column in corpus]
+    col_sort, col_direction, col_page = st.columns([2,1,1])
+    with col_sort:
+        sort_by = st.selectbox("Sorter etter", ["Rekkefølge i korpuset"] + visible_columns)
+    with col_direction:
+        ascending = st.radio("Retning", ["Stigende", "Synkende"], horizontal=True) == "Stigende"
+    with col_page:
+        pages = preview.page_count(corpus, page_size)
+        page_number = st.number_input(f"Side (av {pages})", min_value=1, max_value=pages, value=1)
+
+    sort_column = sort_by if sort_by in visible_columns else None
+    sort_key = (sort_column, ascending)
+    if sort_key not in st.session_state.sort_orders:
+        st.session_state.sort_orders[sort_key] = preview.sort_order(corpus, sort_column, ascending)
+    st.dataframe(preview.page(corpus, st.session_state.sort_orders[sort_key], page_number, page_size, visible_columns))
+
+    excel_file, parquet_file = st.session_state.corpus_files
+    if excel_file is not None:
+        if st.download_button('Last ned data i excelformat', excel_file, filnavn, help = "Åpnes i Excel eller tilsvarende"):
+            pass
+    if st.download_button('Last ned korpusdefinisjon i Parquet-format', parquet_file, os.path.splitext(filnavn)[0] + ".parquet", help = "Mindre og raskere å laste inn i de andre appene enn Excel"):
+        pass
@@ -0,0 +1,55 @@
+"""Corpus definition files written by the corpus app.
+
+The native format is Parquet: metadata columns with few distinct values are
+dictionary encoded, and the file carries a content hash of the corpus table,
+which the other apps verify when the file is uploaded. Excel can still be
+written for older apps.
+"""
+import hashlib
+import json
+from io import BytesIO
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+HASH_KEY = b"dhlab_corpus_hash"
+
+
+def corpus_hash(corpus):
+    """SHA-256 of the corpus table's content, independent of file format."""
+    digest = hashlib.sha256(json.dumps([str(c) for c in corpus.columns]).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(corpus, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def encode_metadata(corpus, max_ratio=0.5):
+    """Dictionary encode text columns where most values repeat; ``urn`` stays plain."""
+    corpus = corpus.copy()
+    for column in corpus.select_dtypes(include=["object", "string"]).columns:
+        values = corpus[column]
+        if column == "urn" or len(values) == 0:
+            continue
+        values = values.where(values.isna(), values.astype(str))
+        if values.nunique() <= max_ratio * len(values):
+            values = values.astype("category")
+        corpus[column] = values
+    return corpus
+
+
+def to_parquet(corpus):
+    """Corpus definition as Parquet bytes with dictionary-encoded metadata and a content hash."""
+    table = pa.Table.from_pandas(encode_metadata(corpus), preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[HASH_KEY] = corpus_hash(corpus).encode("ascii")
+    output = BytesIO()
+    pq.write_table(table.replace_schema_metadata(metadata), output)
+    return output.getvalue()
+
+
+def to_excel(corpus):
+    """Corpus definition as xlsx bytes, for compatibility with older apps."""
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine="openpyxl") as writer:
+        corpus.to_excel(writer, index=False, sheet_name="Sheet1")
+    return output.getvalue()
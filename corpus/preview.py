@@ -0,0 +1,43 @@
+"""Paged corpus preview with precomputed facet counts.
+
+Only the rows on the visible page are sliced out of the corpus and sent to the
+browser. The sort order is computed once per column and direction as an array
+of row positions, so moving between pages is a cheap ``iloc``.
+"""
+import numpy as np
+import pandas as pd
+
+
+def facets(corpus):
+    """Document counts by year, doctype and language; facets whose column is missing are left out."""
+    counts = {}
+    if "year" in corpus:
+        years = pd.to_numeric(corpus["year"], errors="coerce").dropna().astype(int)
+        counts["year"] = years.value_counts().sort_index()
+    if "doctype" in corpus:
+        counts["doctype"] = corpus["doctype"].value_counts()
+    if "langs" in corpus:
+        langs = corpus["langs"].dropna().astype(str).str.split(r"\s*/\s*").explode()
+        counts["langs"] = langs[langs != ""].value_counts()
+    return counts
+
+
+def sort_order(corpus, column=None, ascending=True):
+    """Row positions of ``corpus`` sorted by ``column``, missing values last; corpus order without a column."""
+    if column is None:
+        return np.arange(len(corpus))
+    keys = corpus[column].reset_index(drop=True)
+    return keys.sort_values(ascending=ascending, na_position="last", kind="stable").index.to_numpy()
+
+
+def page_count(corpus, page_size):
+    return max(1, -(-len(corpus) // page_size))
+
+
+def page(corpus, order, number, page_size, columns=None):
+    """Rows on page ``number`` (from 1) in ``order``, restricted to ``columns``."""
+    rows = order[(number - 1) * page_size:number * page_size]
+    visible = corpus.iloc[rows]
+    if columns is not None:
+        visible = visible[[column for column in columns if column in corpus]]
+    return visible
@@ -0,0 +1,151 @@
+"""Local dispersion of words in a document, computed with prefix sums.
+
+The document is fetched once as word counts for consecutive chunks of a few
+tokens each, and kept as integer arrays: a word ID, a count and a chunk number
+per entry, plus the token offset where each chunk starts. Dispersion for any
+word bag, window and step is then a prefix sum over the per-chunk counts, so
+changing the parameters costs O(n) in the length of the document, whatever the
+window size, and needs no new request.
+
+Arcs for many documents are fetched concurrently and resampled onto a common
+0-100% narrative axis, so documents of different lengths can be compared.
+
+The API has no raw token stream, so positions are resolved to the chunk size;
+windows and steps that are multiples of it give exact counts.
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+import dhlab.api.dhlab_api as api
+
+
+class TokenCounts:
+    """Word counts of a document in consecutive chunks, as integer arrays.
+
+    :param chunks: list of ``{word: count}`` dicts in document order, as from ``get_chunks``
+    """
+
+    def __init__(self, chunks):
+        words = pd.Series([word for chunk in chunks for word in chunk], dtype=object)
+        self.word_ids, vocabulary = pd.factorize(words)
+        self.word_ids = self.word_ids.astype(np.int32)
+        self.vocabulary = pd.Index(vocabulary)
+        self.counts = np.fromiter((count for chunk in chunks for count in chunk.values()), dtype=np.int32, count=len(words))
+        self.chunk = np.repeat(np.arange(len(chunks), dtype=np.int32), [len(chunk) for chunk in chunks])
+        lengths = np.bincount(self.chunk, weights=self.counts, minlength=len(chunks))
+        self.offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+
+    @classmethod
+    def fetch(cls, urn, chunk_size=50):
+        """Counts for ``urn`` in chunks of ``chunk_size`` tokens."""
+        chunks = api.get_chunks(urn=urn, chunk_size=chunk_size)
+        if not isinstance(chunks, list):
+            raise ValueError(f"No chunks for {urn}")
+        return cls(chunks)
+
+    def __len__(self):
+        """Number of tokens in the document."""
+        return int(self.offsets[-1])
+
+    def chunk_counts(self, words):
+        """Total count of ``words`` in each chunk."""
+        ids = self.vocabulary.get_indexer(list(words))
+        mask = np.isin(self.word_ids, ids[ids >= 0])
+        counts = np.bincount(self.chunk[mask], weights=self.counts[mask], minlength=len(self.offsets) - 1)
+        return counts.astype(np.int64)
+
+    def window_starts(self, window, step):
+        """Token offsets where windows of ``window`` tokens start, ``step`` tokens apart."""
+        return np.arange(0, max(len(self) - window, 0) + 1, step)
+
+    def chunk_span(self, starts, window):
+        """First and one past the last chunk counted in the windows of ``window`` tokens at ``starts``.
+
+        A window counts the chunks that start inside it.
+        """
+        first = np.searchsorted(self.offsets[:-1], starts, side="left")
+        last = np.searchsorted(self.offsets[:-1], starts + window, side="left")
+        return first, last
+
+    def counts_at(self, words, starts, window):
+        """Count of ``words`` in the windows of ``window`` tokens starting at the token offsets ``starts``."""
+        prefix = np.concatenate([[0], np.cumsum(self.chunk_counts(words))])
+        first, last = self.chunk_span(starts, window)
+        return prefix[last] - prefix[first]
+
+    def window_counts(self, words, window=500, step=100):
+        """Count of ``words`` in each window, from prefix sums over the chunk counts."""
+        return self.counts_at(words, self.window_starts(window, step), window)
+
+    def arc(self, words, window_share=0.05, points=101):
+        """Narrative arc: frequency of ``words`` per 1000 tokens at ``points`` evenly spaced
+        positions from start to end, in windows of ``window_share`` of the document.
+
+        Resampling onto the common axis is done by placing the windows directly
+        at the grid positions, so documents of any length give comparable curves.
+        Each count is divided by the tokens in the chunks the window actually
+        covers, which differs from the nominal window at chunk boundaries.
+        """
+        # a window shorter than a chunk could fall between two chunk starts and count nothing
+        window = max(int(round(window_share * len(self))), int(np.diff(self.offsets).max(initial=1)))
+        starts = np.round(np.linspace(0, max(len(self) - window, 0), points)).astype(np.int64)
+        first, last = self.chunk_span(starts, window)
+        covered = self.offsets[last] - self.offsets[first]
+        counts = self.counts_at(words, starts, window)
+        return np.divide(counts * 1000, covered, out=np.zeros(len(starts)), where=covered > 0)
+
+    def dispersion(self, wordbag, window=500, step=100):
+        """Frame with one column of window counts per word, like ``dhlab.text.Dispersion``.
+
+        :param wordbag: a word, a list of words, or a dict from labels to lists of words
+        """
+        if isinstance(wordbag, str):
+            wordbag = [wordbag]
+        if isinstance(wordbag, dict):
+            bags = wordbag
+        else:
+            bags = {word: [word] for word in wordbag}
+        return pd.DataFrame({label: self.window_counts(words, window, step) for label, words in bags.items()})
+
+
+def fetch_many(urns, chunk_size=50, workers=8):
+    """Fetch :class:`TokenCounts` for many documents concurrently.
+
+    Yields ``(urn, counts, error)`` as documents arrive; ``counts`` is ``None`` when the fetch failed.
+    """
+    urns = list(dict.fromkeys(urns))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(TokenCounts.fetch, urn, chunk_size): urn for urn in urns}
+        try:
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result(), None
+                except Exception as error:
+                    yield futures[future], None, error
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def arcs(documents, words, window_share=0.05, points=101):
+    """Arcs of ``words`` for each of ``documents`` (a mapping from URN to :class:`TokenCounts`).
+
+    :return: frame indexed by position in percent of the text, one column per URN
+    """
+    positions = pd.Index(np.linspace(0, 100, points), name="posisjon")
+    curves = {
+        urn: counts.arc(words, window_share, points)
+        for urn, counts in documents.items() if len(counts) > 0
+    }
+    return pd.DataFrame(curves, index=positions)
+
+
+def bands(arcs, quantiles=(0.1, 0.25, 0.5, 0.75, 0.9)):
+    """Mean and quantiles of the arcs at each position."""
+    values = arcs.to_numpy()
+    result = pd.DataFrame({"gjennomsnitt": values.mean(axis=1)}, index=arcs.index)
+    for q, column in zip(quantiles, np.quantile(values, quantiles, axis=1)):
+        result[f"q{int(round(q * 100))}"] = column
+    return result
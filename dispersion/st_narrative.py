@@ -1,7 +1,14 @@
 import streamlit as st
 import dhlab.text as dh
 from PIL import Image
-import pandas as pd
+import altair as alt
+import corpusdef
+import localdisp
+
+# documents are fetched in chunks of this many tokens; window and step are counted in whole chunks
+chunk_size = 50
+max_arc_documents = 200
+arc_workers = 8
 
 
 @st.cache(suppress_st_warning=True, show_spinner = False)
@@ -14,10 +21,44 @@ def get_corpus(doctype="digibok", from_year=1990, to_year=2020, limit=1000, free
     return corpus.corpus
 
 
-@st.cache(suppress_st_warning=True, show_spinner = False)
+@st.cache(suppress_st_warning=True, show_spinner = False, allow_output_mutation=True)
+def get_token_counts(urn = None):
+    return localdisp.TokenCounts.fetch(urn, chunk_size=chunk_size)
+
+
+@st.cache(suppress_st_warning=True, show_spinner = False, allow_output_mutation=True)
+def get_many_token_counts(urns):
+    """Token counts for many documents, fetched concurrently; returns the counts by urn and the urns that failed"""
+    progress = st.progress(0)
+    documents, failed = {}, []
+    for done, (urn, counts, error) in enumerate(localdisp.fetch_many(urns, chunk_size=chunk_size, workers=arc_workers), start=1):
+        if error is None:
+            documents[urn] = counts
+        else:
+            failed.append(urn)
+        progress.progress(done / len(urns))
+    progress.empty()
+    return documents, failed
+
+
+def arc_chart(arcs, show_curves=False):
+    """Mean narrative arc with 25-75 and 10-90 percentile bands, optionally over the individual arcs"""
+    summary = localdisp.bands(arcs).reset_index()
+    base = alt.Chart(summary).encode(x=alt.X("posisjon", title="Posisjon i teksten (%)"))
+    layers = [
+        base.mark_area(opacity=0.2).encode(y=alt.Y("q10", title="Forekomster per 1000 ord"), y2="q90"),
+        base.mark_area(opacity=0.3).encode(y="q25", y2="q75"),
+        base.mark_line(color="black").encode(y="gjennomsnitt"),
+    ]
+    if show_curves:
+        curves = arcs.reset_index().melt(id_vars="posisjon", var_name="urn", value_name="frekvens")
+        layers.insert(0, alt.Chart(curves).mark_line(opacity=0.15, strokeWidth=1).encode(x="posisjon", y="frekvens", detail="urn"))
+    return alt.layer(*layers)
+
+
 def get_dispersion(urn = None, wordbag = None, window=1500, pr=100):
-    d = dh.Dispersion(urn=urn, wordbag=wordbag, window=window, pr=pr)
-    return d
+    """Dispersion computed locally from the document's token counts, which are fetched once per document"""
+    return get_token_counts(urn).dispersion(wordbag, window=window, step=pr)
 
 
 
@@ -34,7 +75,7 @@ doctypes = {'Alle dokumenter': 'all', 'Aviser': 'digavis', 'Bøker': 'digibok',
 
 title = st.sidebar.title("Korpus")
 uploaded_corpus = st.sidebar.file_uploader(
-    "Last opp korpusdefinisjon som Excel-ark", type=["xlsx"], accept_multiple_files=False, key="corpus_upload"
+    "Last opp korpusdefinisjon (Excel, Parquet eller CSV)", type=["xlsx", "parquet", "csv"], accept_multiple_files=False, key="corpus_upload"
 )
 
 if st.session_state.corpus_upload is None:
@@ -65,26 +106,57 @@ if st.session_state.corpus_upload is None:
     with st.spinner('Sampler nytt korpus...'):
         corpus = get_corpus(doctype=doctype, from_year=from_year, to_year=to_year, limit=limit, freetext=freetext, fulltext=fulltext)
 else:
-    corpus = pd.read_excel(uploaded_corpus)
+    try:
+        corpus = corpusdef.load_upload(uploaded_corpus)
+    except:
+        st.error("Korpusfilen kunne ikke leses, eller innholdet stemmer ikke med sjekksummen i filen. Last ned korpuset på nytt fra korpusappen.")
+        st.stop()
 
 
 title2 = st.sidebar.title("Parametere for graf")
-window = st.sidebar.number_input("Størrelse på tekst det telles i (vindu)", min_value = 300, value=500)
-pr = st.sidebar.number_input("Antall steg mellom hvert vindu", min_value = 100, value=100)
+window = st.sidebar.number_input("Størrelse på tekst det telles i (vindu)", min_value = 300, value=500, step=chunk_size)
+pr = st.sidebar.number_input("Antall steg mellom hvert vindu", min_value = 100, value=100, step=chunk_size)
 
 
-#st.write(corpus)
-choices = [', '.join([str(z) for z in x]) for x in corpus[['authors','title', 'year','urn']].values.tolist()]
-valg = st.selectbox("Velg et dokument", choices)
+mode = st.radio("Vis", ['Ett dokument', 'Flere dokumenter'], horizontal=True, help="Med flere dokumenter vises gjennomsnittet og spredningen av de narrative buene, med tekstene strukket til samme lengde")
 
-urn = valg.split(', ')[-1]
+if mode == 'Ett dokument':
+    #st.write(corpus)
+    choices = [', '.join([str(z) for z in x]) for x in corpus[['authors','title', 'year','urn']].values.tolist()]
+    valg = st.selectbox("Velg et dokument", choices)
 
+    urn = valg.split(', ')[-1]
 
-words = st.text_input('Angi ord som skal telles', '. ,')
-words = words.split()
 
-try:
-    dispersion = get_dispersion(urn=urn, wordbag=words, window=window, pr=pr)
-    st.line_chart(dispersion.dispersion)
-except:
-    st.write(f"Noe gikk galt med {' '.join(valg.split()[:-1])}, prøve et annet dokument")
+    words = st.text_input('Angi ord som skal telles', '. ,')
+    words = words.split()
+
+    try:
+        dispersion = get_dispersion(urn=urn, wordbag=words, window=window, pr=pr)
+        st.line_chart(dispersion)
+    except:
+        st.write(f"Noe gikk galt med {' '.join(valg.split()[:-1])}, prøve et annet dokument")
+else:
+    urns = list(corpus.urn.dropna().drop_duplicates())
+    if not urns:
+        st.write("Korpuset har ingen dokumenter å vise")
+        st.stop()
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        n_docs = st.number_input("Antall dokumenter", min_value=1, max_value=min(max_arc_documents, len(urns)), value=min(50, len(urns)))
+    with col2:
+        window_share = st.slider("Vindu i prosent av teksten", 1, 20, 5)
+    with col3:
+        show_curves = st.checkbox("Vis hver tekst")
+
+    words = st.text_input('Angi ord som skal telles', '. ,', key="arc_words")
+    words = words.split()
+
+    documents, failed = get_many_token_counts(tuple(urns[:int(n_docs)]))
+    if failed:
+        st.write(f"Kunne ikke hente {len(failed)} av dokumentene")
+    arcs = localdisp.arcs(documents, words, window_share=window_share / 100)
+    if arcs.empty:
+        st.write("Fant ingen tekster å vise")
+    else:
+        st.altair_chart(arc_chart(arcs, show_curves), use_container_width=True)
@@ -1,9 +1,10 @@
 import dhlab as dh
 import streamlit as st
 import pandas as pd
-import re
 
 import traceback
+import corpusdef
+import urnresolve
 
 normal_size = 800
 max_doc = 1200
@@ -63,11 +64,10 @@ st.sidebar.markdown("Velg et korpus fra [corpus-appen](https://beta.nb.no/dhlab/
 corpus_defined = False
 urner = st.sidebar.text_area("Lim inn URNer:","", help="Lim en tekst som har URNer i seg. Teksten trenger ikke å være formatert")
 if urner != "":
-    urns = re.findall("URN:NBN[^\s.,]+", urner)
+    urns = urnresolve.find_urns(urner)
     if urns != []:
         corpus_defined = True
-        corpus = dh.Corpus(doctype='digibok',limit=0)
-        corpus.extend_from_identifiers(urns)
+        corpus = dh.Corpus.from_df(urnresolve.default_resolver().resolve(urns))
         #st.write(urns)
     else:
         st.write('Fant ingen URNer')
@@ -75,10 +75,13 @@ if urner != "":
 uploaded_file = st.sidebar.file_uploader("Last opp et korpus", help="Dra en fil over hit, fra et nedlastningsikon, eller velg fra en mappe")
 if uploaded_file is not None:
     corpus_defined = True
-    dataframe = pd.read_excel(uploaded_file)
+    try:
+        dataframe = corpusdef.load_upload(uploaded_file)
+    except:
+        st.error("Korpusfilen kunne ikke leses, eller innholdet stemmer ikke med sjekksummen i filen. Last ned korpuset på nytt fra korpusappen.")
+        st.stop()
     st.sidebar.subheader('Korpus')
-    corpus = dh.Corpus(doctype='digibok',limit=0)
-    corpus.extend_from_identifiers(list(dataframe.urn))
+    corpus = dh.Corpus.from_df(urnresolve.default_resolver().resolve(dataframe.urn))
 
 
 if corpus_defined:
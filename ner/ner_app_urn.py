@@ -14,7 +14,12 @@ from dhlab.text.nbtokenizer import tokenize
 # for excelnedlastning
 from io import BytesIO
 
-import re
+import corpusdef
+import nerbatch
+import urnresolve
+import network
+
+batch_workers = 4
 
 @st.cache(suppress_st_warning=True, show_spinner = False)
 def get_corpus(freetext=None, title=None, from_year=1900, to_year=2020):
@@ -24,35 +29,34 @@ def get_corpus(freetext=None, title=None, from_year=1900, to_year=2020):
 
 @st.cache(suppress_st_warning=True, show_spinner = False)
 def get_ner(urn, model):
-    df = dh.NER(urn = urn, model = model).ner.set_index('token')
-    df_defined = True
-    personer = df[df["ner"].str.contains("PER")] 
-    steder = df[df['ner'].str.contains('LOC')]
-    organisasjoner = df[df["ner"].str.contains("ORG")]
-    produkter =  df[df["ner"].str.contains("PROD")]
-
-    andre = df[
-        (~df["ner"].str.contains("PER")) &
-        (~df.ner.str.contains('ORG')) &
-        (~df.ner.str.contains('PROD')) &
-        (~df['ner'].str.contains('LOC'))]
+    df = nerbatch.analyse(urn, model, 'NER').set_index('token')
+    personer, steder, organisasjoner, produkter, andre = nerbatch.partition(df, 'ner', nerbatch.ner_groups)
     return df, personer, steder, organisasjoner, produkter, andre
 
 @st.cache(suppress_st_warning=True, show_spinner = False)
 def get_pos(urn, model):
-    df = dh.POS(urn = urn, model = model).pos.set_index('token')
-    df_defined = True
-    noun = df[df.pos.str.contains('NOUN')]
-    verb = df[df.pos.str.contains('VERB')]
-    adj = df[df.pos.str.contains('ADJ')]
-    prep = df[df.pos.str.contains('ADP')]
-    andre = df[
-        (~df.pos.str.contains("NOUN")) &
-        (~df.pos.str.contains('VERB')) &
-        (~df.pos.str.contains('ADJ')) &
-        (~df.pos.str.contains('ADP'))]
+    df = nerbatch.analyse(urn, model, 'POS').set_index('token')
+    noun, verb, adj, prep, andre = nerbatch.partition(df, 'pos', nerbatch.pos_groups)
     return df, noun, verb, adj, prep, andre
 
+@st.cache(suppress_st_warning=True, show_spinner=False)
+def get_models():
+    return dh.Models().models
+
+def run_batch(urns, model, analyse_type):
+    """Analyse all urns in a worker pool with a progress bar; returns the entity index and the urns that failed"""
+    urns = list(dict.fromkeys(urns))
+    progress = st.progress(0)
+    tables, failed = {}, []
+    for done, (urn, table, error) in enumerate(nerbatch.batch_analyse(urns, model, analyse_type, workers=batch_workers), start=1):
+        if error is None:
+            tables[urn] = table
+        else:
+            failed.append(urn)
+        progress.progress(done / len(urns))
+    progress.empty()
+    return nerbatch.entity_index(tables, analyse_type), failed
+
 @st.cache(suppress_st_warning=True, show_spinner=False)
 def to_excel(df):
     """Make an excel object out of a dataframe as an IO-object"""
@@ -97,12 +101,10 @@ with icol2:
     if method == 'Urnliste':
         urner = st.text_area("Lim inn URNer:","", help="Lim tekst med URNer. Teksten trenger ikke å være formatert, og kan inneholde mer enn URNer")
         if urner != "":
-            urns = re.findall("URN:NBN[^\s.,]+", urner)
+            urns = urnresolve.find_urns(urner)
             if urns != []:
                 corpus_defined = True
-                corpus = dh.Corpus(doctype='digibok',limit=0)
-                corpus.extend_from_identifiers(urns)
-                corpus = corpus.corpus
+                corpus = urnresolve.default_resolver().resolve(urns)
                 #st.write(corpus)
             else:
                 st.write('Fant ingen URNer')
@@ -110,10 +112,12 @@ with icol2:
         uploaded_file = st.file_uploader("Last opp et korpus", help="Dra en fil over hit, fra et nedlastningsikon, eller velg fra en mappe")
         if uploaded_file is not None:
             corpus_defined = True
-            dataframe = pd.read_excel(uploaded_file)
-            corpus = dh.Corpus(doctype='digibok',limit=0)
-            corpus.extend_from_identifiers(list(dataframe.urn))
-            corpus = corpus.corpus
+            try:
+                dataframe = corpusdef.load_upload(uploaded_file)
+            except:
+                st.error("Korpusfilen kunne ikke leses, eller innholdet stemmer ikke med sjekksummen i filen. Last ned korpuset på nytt fra korpusappen.")
+                st.stop()
+            corpus = urnresolve.default_resolver().resolve(dataframe.urn)
         
     else:
         stikkord = st.text_input('Angi noen stikkord for å forme et utvalg tekster','', 
@@ -125,6 +129,10 @@ with icol2:
         corpus_defined = True
         corpus = get_corpus(freetext=stikkord)
 
+if corpus_defined and len(corpus) == 0:
+    st.warning('Fant ingen metadata for URNene i korpuset')
+    corpus_defined = False
+
 if corpus_defined:
     choices = [', '.join([str(z) for z in x]) for x in corpus[['authors','title', 'year','urn']].values.tolist()]
 else:
@@ -157,7 +165,7 @@ if choices != []:
             analyse_type = st.selectbox("Analysetype — navn (NER) eller kategorier (POS)", ['NER', 'POS'])
             
         with colB:
-            model = st.selectbox("Språkmodell", dh.Models().models, help= "Forskjellige modeller gir"
+            model = st.selectbox("Språkmodell", get_models(), help= "Forskjellige modeller gir"
         "forskjellig resultat — da for dansk og nb for norsk bokmål")
             
         submit_button = st.form_submit_button(label=f'Analyser URN', help = "det kan ta inntil"
@@ -229,5 +237,101 @@ if choices != []:
     if df_defined:
         if st.download_button(f"Last ned data i excelformat til '{filename}'", to_excel(df.reset_index()),filename, help = "Åpnes i Excel eller tilsvarende"):
             True
+
+    st.markdown("#### Sammenlign språkmodeller på den valgte teksten")
+    with st.form(key='compare_form'):
+        colA, colB = st.columns(2)
+        with colA:
+            compare_type = st.selectbox("Analysetype — navn (NER) eller kategorier (POS)", ['NER', 'POS'], key='compare_type')
+        with colB:
+            compare_with = st.multiselect("Språkmodeller", get_models(), help="Modellene kjøres samtidig, og resultater som er hentet før gjenbrukes")
+        compare_button = st.form_submit_button(label="Sammenlign modellene")
+
+    if compare_button:
+        if len(compare_with) < 2:
+            st.write("Velg minst to språkmodeller")
+        else:
+            tables, failed_models = nerbatch.compare_models(urn, compare_with, compare_type)
+            if failed_models:
+                st.warning(f"Kunne ikke analysere teksten med {', '.join(failed_models)}")
+            if len(tables) < 2:
+                st.write("Trenger minst to språkmodeller som virker for å sammenligne")
+            else:
+                aligned = nerbatch.align_models(tables, compare_type)
+                agreement = aligned.enighet.value_counts()
+                st.write(f"Modellene er enige om {agreement['enig']} ord, uenige om {agreement['uenig']} og bare noen av dem merker {agreement['delvis']}")
+                st.dataframe(aligned)
+                if st.download_button("Last ned sammenligningen i excelformat", to_excel(aligned.reset_index()), f"{fname}_modeller.xlsx", help = "Åpnes i Excel eller tilsvarende"):
+                    True
+
+    st.markdown("#### Analyser alle tekstene i gruppen og lag en samlet indeks")
+    with st.form(key='batch_form'):
+        colA, colB = st.columns(2)
+        with colA:
+            batch_type = st.selectbox("Analysetype — navn (NER) eller kategorier (POS)", ['NER', 'POS'], key='batch_type')
+        with colB:
+            batch_model = st.selectbox("Språkmodell", get_models(), key='batch_model')
+        batch_button = st.form_submit_button(label=f"Analyser alle {corpus.urn.nunique()} tekstene", help=f"{batch_workers} tekster analyseres om gangen")
+
+    if batch_button:
+        index, failed = run_batch(corpus.urn, batch_model, batch_type)
+        st.session_state.entity_index = index
+        st.session_state.pop('network', None)
+        if failed:
+            st.warning(f"Kunne ikke analysere {len(failed)} tekster: {', '.join(failed)}")
+
+    if "entity_index" in st.session_state:
+        index = st.session_state.entity_index
+        qcol1, qcol2, qcol3 = st.columns([2,2,1])
+        with qcol1:
+            entity = st.text_input("Søk i indeksen", "", help="Viser enheter som inneholder søket")
+        with qcol2:
+            types = st.multiselect("Kategorier", sorted(index['type'].unique()))
+        with qcol3:
+            view = st.radio("Visning", ['Totalt', 'Per tekst'])
+        result = nerbatch.query_index(index, entity, types)
+        if view == 'Totalt':
+            result = nerbatch.entity_totals(result)
+        else:
+            result = result.sort_values(by='freq', ascending=False)
+        st.dataframe(result)
+        if st.download_button("Last ned indeksen i excelformat", to_excel(result), "indeks.xlsx", help = "Åpnes i Excel eller tilsvarende"):
+            True
+
+        st.markdown("#### Nettverk av enheter som forekommer sammen")
+        with st.form(key='network_form'):
+            ncol1, ncol2, ncol3 = st.columns(3)
+            with ncol1:
+                unit = st.selectbox("Samforekomst i", ['Tekster', 'Avsnitt i valgt tekst'], help="Enhetene i søket over, enten på tvers av tekstene eller innenfor avsnittene i teksten som er valgt øverst")
+            with ncol2:
+                min_count = st.number_input("Minste antall samforekomster", min_value=1, value=2)
+            with ncol3:
+                max_entities = st.number_input("Maks antall enheter", min_value=10, value=2000, help="De hyppigste enhetene tas med")
+            network_button = st.form_submit_button(label="Lag nettverk")
+
+        if network_button:
+            selected = nerbatch.query_index(index, entity, types)
+            if unit == 'Tekster':
+                matrix, labels = network.document_matrix(selected, max_entities)
+            else:
+                matrix, labels = network.paragraph_matrix(urn, selected[selected.urn == urn], max_entities)
+            counts = network.cooccurrence(matrix, min_count)
+            st.session_state.network = (network.communities(counts, labels), network.edges(counts, labels))
+
+        if "network" in st.session_state:
+            groups, links = st.session_state.network
+            if links.empty:
+                st.write("Ingen enheter forekommer sammen ofte nok")
+            else:
+                st.write(f"{groups.community.nunique()} grupper, {len(groups)} enheter og {len(links)} forbindelser")
+                ncol1, ncol2 = st.columns(2)
+                with ncol1:
+                    st.dataframe(groups)
+                    if st.download_button("Last ned gruppene i excelformat", to_excel(groups), "grupper.xlsx", help = "Åpnes i Excel eller tilsvarende"):
+                        True
+                with ncol2:
+                    st.dataframe(links)
+                    if st.download_button("Last ned forbindelsene i excelformat", to_excel(links), "forbindelser.xlsx", help = "Åpnes i Excel eller tilsvarende"):
+                        True
 else:
     st.write("Her dukker det opp en tekstvelger så snart listen av tekster er definert")
\ No newline at end of file
@@ -0,0 +1,151 @@
+"""NER and POS analysis of a whole corpus through a bounded worker pool.
+
+Each document is analysed remotely, which can take up to half a minute, so the
+documents are sent concurrently by a fixed number of workers. The per-document
+tables are merged into one index with a row per (entity, type, urn).
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+import dhlab as dh
+
+import nercache
+
+index_columns = ["entity", "type", "urn", "freq"]
+
+# tag groups shown in the app, in order of precedence; other tags go to "andre"
+ner_groups = ["PER", "LOC", "ORG", "PROD"]
+pos_groups = ["NOUN", "VERB", "ADJ", "ADP"]
+
+# column holding the tag in the tables from dh.NER and dh.POS
+tag_columns = {"NER": "ner", "POS": "pos"}
+
+
+def _analyse_remote(urn, model, analyse_type):
+    if analyse_type == "NER":
+        return dh.NER(urn=urn, model=model).ner
+    return dh.POS(urn=urn, model=model).pos
+
+
+def analyse(urn, model, analyse_type="NER"):
+    """NER or POS table for one document, with ``token``, tag and ``frekv`` columns.
+
+    Results come from the persistent cache in :mod:`nercache` when they are there.
+    """
+    return nercache.default_cache().fetch(urn, model, analyse_type, lambda: _analyse_remote(urn, model, analyse_type))
+
+
+def partition(table, column, groups):
+    """Split ``table`` into one frame per group in ``groups`` plus a last one for the other rows.
+
+    A row belongs to the first group whose name occurs in its tag. Each
+    distinct tag is matched once, and the rows are split with a single groupby
+    over the group codes looked up from the tags' category codes.
+    """
+    tags = table[column].astype("category")
+    other = len(groups)
+    group_codes = np.array(
+        [next((i for i, group in enumerate(groups) if group in str(tag)), other) for tag in tags.cat.categories]
+        + [other]
+    )
+    # missing tags have category code -1, which picks the trailing "other" entry
+    codes = group_codes[tags.cat.codes.to_numpy()]
+    parts = {code: frame for code, frame in table.groupby(codes)}
+    return [parts.get(code, table.iloc[:0]) for code in range(other + 1)]
+
+
+def batch_analyse(urns, model, analyse_type="NER", workers=4):
+    """Analyse every URN in ``urns``, at most ``workers`` at a time.
+
+    Yields ``(urn, table, error)`` as documents finish; ``table`` is ``None``
+    for documents that failed, and ``error`` is the exception.
+    """
+    urns = list(dict.fromkeys(urns))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(analyse, urn, model, analyse_type): urn for urn in urns}
+        try:
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result(), None
+                except Exception as error:
+                    yield futures[future], None, error
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def compare_models(urn, models, analyse_type="NER"):
+    """Analyse one document with each of ``models`` concurrently.
+
+    A model that fails does not stop the others.
+
+    :return: tuple of (mapping from model to table, in the order of ``models``, list of models that failed)
+    """
+    models = list(dict.fromkeys(models))
+    tables, failed = {}, []
+    with ThreadPoolExecutor(max_workers=max(1, len(models))) as pool:
+        futures = {model: pool.submit(analyse, urn, model, analyse_type) for model in models}
+        for model, future in futures.items():
+            try:
+                tables[model] = future.result()
+            except Exception:
+                failed.append(model)
+    return tables, failed
+
+
+def align_models(tables, analyse_type="NER"):
+    """Token × model table of tags, with an ``enighet`` column saying where the models agree.
+
+    A token with several tags in one model gets them joined by ``/``. A token
+    is ``enig`` when every model gives it the same tags, ``uenig`` when they
+    differ, and ``delvis`` when some models do not tag it at all; rows are
+    sorted in that order, disagreements first.
+    """
+    tag = tag_columns[analyse_type]
+    columns = {}
+    for model, table in tables.items():
+        tags = table[["token", tag]].dropna().drop_duplicates().sort_values(tag)
+        columns[model] = tags.groupby("token")[tag].agg("/".join)
+    aligned = pd.DataFrame(columns)
+    found = aligned.notna().sum(axis=1)
+    distinct = aligned.nunique(axis=1)
+    aligned["enighet"] = pd.Categorical(
+        np.select([found < len(columns), distinct == 1], ["delvis", "enig"], default="uenig"),
+        categories=["uenig", "delvis", "enig"],
+    )
+    return aligned.sort_values("enighet", kind="stable")
+
+
+def entity_index(tables, analyse_type="NER"):
+    """Merge per-document tables into one index with columns ``entity, type, urn, freq``.
+
+    :param tables: mapping from URN to the table returned by :func:`analyse`
+    """
+    tag = tag_columns[analyse_type]
+    frames = [
+        table.assign(urn=urn)[["token", tag, "urn", "frekv"]].set_axis(index_columns, axis=1)
+        for urn, table in tables.items() if table is not None and len(table) > 0
+    ]
+    if not frames:
+        return pd.DataFrame(columns=index_columns)
+    index = pd.concat(frames, ignore_index=True)
+    return index.groupby(["entity", "type", "urn"], as_index=False, observed=True)["freq"].sum()
+
+
+def entity_totals(index):
+    """Total frequency and number of documents per (entity, type), most frequent first."""
+    totals = index.groupby(["entity", "type"], as_index=False, observed=True).agg(
+        freq=("freq", "sum"), docs=("urn", "nunique")
+    )
+    return totals.sort_values("freq", ascending=False, ignore_index=True)
+
+
+def query_index(index, entity="", types=None):
+    """Rows whose entity contains ``entity`` (case-insensitive) and whose type is in ``types``."""
+    mask = pd.Series(True, index=index.index)
+    if entity:
+        mask &= index["entity"].astype(str).str.contains(entity, case=False, regex=False)
+    if types:
+        mask &= index["type"].isin(types)
+    return index[mask]
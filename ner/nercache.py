@@ -0,0 +1,135 @@
+"""Persistent on-disk cache of NER and POS results.
+
+Analysing a document with a given spaCy model always gives the same table, so
+results are stored as Parquet files named by a hash of (analysis, model, urn)
+and shared by every process that mounts the same directory. In deployment.yaml
+that is a persistent volume claim, so the cache survives restarts and rollouts
+and is shared by all replicas. Files are written atomically, reads refresh the
+file's modification time, and the least recently used files are removed when
+the cache grows past ``max_bytes``.
+
+Caching is best effort: if the directory cannot be created or a table cannot
+be written, a warning is logged and the computed table is still returned.
+
+Popular documents can be analysed ahead of time, from any pod or job that
+mounts the same volume, with::
+
+    NER_CACHE_DIR=/cache python nercache.py MODEL urns.txt [NER|POS]
+"""
+import hashlib
+import logging
+import os
+import sys
+import threading
+
+import pandas as pd
+
+cache_dir = os.environ.get("NER_CACHE_DIR", "cache")
+# the default fits in the pod's ephemeral storage; deployment.yaml sets it to fit the cache volume
+max_bytes = int(os.environ.get("NER_CACHE_MAX_BYTES", 128 * 1024 ** 2))
+
+
+class ResultCache:
+    """Parquet files in ``directory`` keyed by (urn, model, analysis), bounded to ``max_bytes``."""
+
+    def __init__(self, directory=cache_dir, max_bytes=max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        try:
+            os.makedirs(directory, exist_ok=True)
+        except OSError as e:
+            logging.warning(f"NER cache directory {directory} is not usable, results will not be cached: {e}")
+        self._size = sum(size for _, size, _ in self._files())
+
+    def path(self, urn, model, analyse_type):
+        key = hashlib.sha256(f"{analyse_type}\0{model}\0{urn}".encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, key[:2], f"{key}.parquet")
+
+    def _files(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(".parquet"):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    yield path, stat.st_size, stat.st_mtime
+
+    def get(self, urn, model, analyse_type):
+        """Cached table, or ``None`` on a miss."""
+        path = self.path(urn, model, analyse_type)
+        try:
+            table = pd.read_parquet(path)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return table
+
+    def put(self, urn, model, analyse_type, table):
+        path = self.path(urn, model, analyse_type)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            table.to_parquet(tmp, index=False)
+            os.replace(tmp, path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        with self._lock:
+            self._size += os.path.getsize(path)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Remove least recently used files until the cache is at 90% of ``max_bytes``."""
+        files = sorted(self._files(), key=lambda file: file[2])
+        self._size = sum(size for _, size, _ in files)
+        for path, size, _ in files:
+            if self._size <= 0.9 * self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._size -= size
+
+    def fetch(self, urn, model, analyse_type, compute):
+        """Cached table for the key, computing and storing it with ``compute()`` on a miss.
+
+        A table that cannot be stored is still returned.
+        """
+        table = self.get(urn, model, analyse_type)
+        if table is None:
+            table = compute()
+            try:
+                self.put(urn, model, analyse_type, table)
+            except Exception as e:
+                logging.warning(f"Could not cache {analyse_type} for {urn} with {model}: {e}")
+        return table
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_cache():
+    """The process-wide cache in ``NER_CACHE_DIR``."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = ResultCache()
+    return _default
+
+
+if __name__ == "__main__":
+    import nerbatch
+
+    model, urn_file = sys.argv[1], sys.argv[2]
+    analyse_type = sys.argv[3] if len(sys.argv) > 3 else "NER"
+    with open(urn_file, encoding="utf-8") as f:
+        urns = list(dict.fromkeys(line.strip() for line in f if line.strip()))
+    failed = [urn for urn, _, error in nerbatch.batch_analyse(urns, model, analyse_type) if error is not None]
+    print(f"{len(urns) - len(failed)} of {len(urns)} documents cached in {os.path.abspath(default_cache().directory)}")
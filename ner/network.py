@@ -0,0 +1,119 @@
+"""Entity co-occurrence networks with sparse matrices and Louvain communities.
+
+Entities are rows of a sparse binary incidence matrix against documents (from
+the batch entity index) or against the paragraphs of one document. The
+co-occurrence counts are the sparse product of that matrix with its
+transpose, so no dense entity × entity table is ever built; weak edges are
+pruned before the graph is handed to the Louvain community detection.
+"""
+import numpy as np
+import pandas as pd
+import networkx as nx
+import community as community_louvain
+from scipy import sparse
+
+import dhlab.api.dhlab_api as api
+
+
+def _top_entities(index, max_entities):
+    """The ``max_entities`` most frequent (entity, type) pairs in ``index``."""
+    totals = index.groupby(["entity", "type"], observed=True)["freq"].sum()
+    return totals.nlargest(max_entities).index
+
+
+def document_matrix(index, max_entities=5000):
+    """Binary entity × document matrix from an entity index (``entity, type, urn, freq``).
+
+    :return: ``(matrix, entities)``, where ``entities`` is a frame with
+        ``entity``, ``type`` and ``freq`` for each row of the matrix
+    """
+    keep = _top_entities(index, max_entities)
+    index = index.set_index(["entity", "type"]).loc[keep].reset_index()
+    groups = index.groupby(["entity", "type"], sort=False, observed=True)
+    rows = groups.ngroup().to_numpy()
+    cols, urns = pd.factorize(index["urn"])
+    labels = groups["freq"].sum().reset_index()
+    matrix = sparse.csr_matrix(
+        (np.ones(len(index), dtype=np.int32), (rows, cols)), shape=(len(labels), len(urns))
+    )
+    return matrix, labels
+
+
+def paragraph_matrix(urn, index, max_entities=5000):
+    """Binary entity × paragraph matrix for one document.
+
+    An entity occurs in a paragraph when all its words do. Word counts per
+    paragraph come from ``get_chunks_para``; the test is a sparse product of an
+    entity × word matrix and a word × paragraph matrix.
+
+    :param index: entity index rows (``entity, type, urn, freq``) for the document
+    :return: ``(matrix, entities)`` as for :func:`document_matrix`
+    """
+    keep = _top_entities(index, max_entities)
+    labels = index.groupby(["entity", "type"], observed=True)["freq"].sum().loc[keep].reset_index()
+
+    paragraphs = api.get_chunks_para(urn) or []
+    words = pd.Series([word for paragraph in paragraphs for word in paragraph])
+    para = np.repeat(np.arange(len(paragraphs)), [len(paragraph) for paragraph in paragraphs])
+    word_codes, vocabulary = pd.factorize(words)
+    occurs = sparse.csr_matrix(
+        (np.ones(len(word_codes), dtype=np.int32), (word_codes, para)), shape=(len(vocabulary), len(paragraphs))
+    )
+
+    entity_words = labels["entity"].astype(str).str.split().explode()
+    word_index = vocabulary.get_indexer(entity_words)
+    known = word_index >= 0
+    n_words = entity_words.groupby(level=0).size().to_numpy()
+    composition = sparse.csr_matrix(
+        (np.ones(known.sum(), dtype=np.int32), (entity_words.index.to_numpy()[known], word_index[known])),
+        shape=(len(labels), len(vocabulary)),
+    )
+    hits = (composition @ (occurs > 0).astype(np.int32)).tocoo()
+    present = hits.data == n_words[hits.row]
+    matrix = sparse.csr_matrix(
+        (np.ones(present.sum(), dtype=np.int32), (hits.row[present], hits.col[present])), shape=hits.shape
+    )
+    return matrix, labels
+
+
+def cooccurrence(matrix, min_count=2):
+    """Entity × entity co-occurrence counts, without self loops and edges below ``min_count``."""
+    counts = sparse.triu(matrix @ matrix.T, k=1).tocsr()
+    counts.data[counts.data < min_count] = 0
+    counts.eliminate_zeros()
+    return counts
+
+
+def edges(counts, labels):
+    """Edge list with ``source``, ``source_type``, ``target``, ``target_type`` and ``weight``, heaviest first.
+
+    The types tell apart nodes with the same surface form, e.g. "Ibsen" as PER and as ORG.
+    """
+    coo = counts.tocoo()
+    names = labels["entity"].to_numpy()
+    types = labels["type"].to_numpy()
+    frame = pd.DataFrame({
+        "source": names[coo.row], "source_type": types[coo.row],
+        "target": names[coo.col], "target_type": types[coo.col],
+        "weight": coo.data,
+    })
+    return frame.sort_values("weight", ascending=False, ignore_index=True)
+
+
+def communities(counts, labels, resolution=1.0, seed=0):
+    """Louvain communities of the co-occurrence graph; isolated entities are left out.
+
+    :return: ``labels`` with ``community`` and weighted ``degree`` columns, by community and degree
+    """
+    graph = nx.Graph()
+    coo = counts.tocoo()
+    graph.add_weighted_edges_from(zip(coo.row.tolist(), coo.col.tolist(), coo.data.tolist()))
+    if graph.number_of_edges() == 0:
+        return labels.iloc[:0].assign(community=pd.Series(dtype=int), degree=pd.Series(dtype=int))
+    partition = community_louvain.best_partition(graph, weight="weight", resolution=resolution, random_state=seed)
+    nodes = np.fromiter(partition.keys(), dtype=int)
+    result = labels.iloc[nodes].assign(
+        community=list(partition.values()),
+        degree=[graph.degree(node, weight="weight") for node in nodes.tolist()],
+    )
+    return result.sort_values(["community", "degree"], ascending=[True, False], ignore_index=True)
@@ -0,0 +1,116 @@
+"""Bulk resolution of URNs to document metadata.
+
+Pasted URN lists are deduplicated, and only URNs that have not been resolved
+before are looked up. They are sent in chunks, concurrently, over a pooled
+HTTP session; the metadata is cached per URN, so pasting the list again after
+a small edit only looks up the URNs that are new.
+"""
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from dhlab.constants import BASE_URL
+
+urn_pattern = re.compile(r"URN:NBN[^\s.,]+")
+
+# columns of the metadata rows, so an empty result still has them
+metadata_columns = [
+    "dhlabid", "urn", "title", "authors", "city", "timestamp", "year",
+    "publisher", "langs", "subjects", "ddc", "genres", "literaryform", "doctype",
+]
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session(pool_size=8):
+    """HTTP session shared by all threads, with a connection pool of ``pool_size``."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+    return _session
+
+
+def find_urns(text):
+    """URNs in ``text`` in order of first occurrence, without duplicates."""
+    return list(dict.fromkeys(urn_pattern.findall(text)))
+
+
+def fetch_metadata(urns):
+    """Metadata rows for ``urns`` as record dicts, same endpoint as ``dhlab.api.dhlab_api.get_metadata``.
+
+    The response is read through a ``DataFrame`` like dhlab does, so it may come as records or as columns.
+    """
+    r = get_session().post(f"{BASE_URL}/get_metadata", json={"urns": urns})
+    r.raise_for_status()
+    return pd.DataFrame(r.json()).to_dict("records")
+
+
+class URNResolver:
+    """Resolves URNs to metadata, remembering up to ``max_entries`` URNs.
+
+    :param chunk_size: number of URNs per request
+    :param workers: number of concurrent requests
+    """
+
+    def __init__(self, chunk_size=500, workers=8, max_entries=200000):
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, urns):
+        chunks = [urns[i:i + self.chunk_size] for i in range(0, len(urns), self.chunk_size)]
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for rows in pool.map(fetch_metadata, chunks):
+                yield from rows
+
+    def resolve(self, urns):
+        """Metadata frame for ``urns``, one row per distinct URN found, in input order.
+
+        Missing and empty values in ``urns`` are skipped. When no URN is found
+        the frame is empty but has the :data:`metadata_columns`.
+        """
+        urns = list(dict.fromkeys(str(urn).strip() for urn in urns if pd.notna(urn) and str(urn).strip()))
+        with self._lock:
+            new = [urn for urn in urns if urn not in self._cache]
+        if new:
+            found = {row["urn"]: row for row in self._lookup(new)}
+            with self._lock:
+                # URNs without metadata are remembered too, so they are not looked up again
+                for urn in new:
+                    self._cache[urn] = found.get(urn)
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+        with self._lock:
+            rows = []
+            for urn in urns:
+                if urn in self._cache:
+                    self._cache.move_to_end(urn)
+                    if self._cache[urn] is not None:
+                        rows.append(self._cache[urn])
+        if not rows:
+            return pd.DataFrame(columns=metadata_columns)
+        return pd.DataFrame(rows)
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_resolver():
+    """The resolver shared by all sessions in this process."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = URNResolver()
+    return _default